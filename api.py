@@ -0,0 +1,189 @@
+import codecs
+import json
+from datetime import datetime
+from flask import Blueprint, abort, current_app, make_response, request
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+from models import Artist, Show, Venue
+from pagination import keyset
+from cache import cached
+import bulk
+import feeds
+import search
+import serializers
+
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def venue_item(v):
+  return {
+    'id': v.id,
+    'name': v.name,
+    'city': v.city,
+    'state': v.state,
+    'num_upcoming_shows': v.upcoming_show_count,
+  }
+
+
+def artist_item(a):
+  return {
+    'id': a.id,
+    'name': a.name,
+    'city': a.city,
+    'state': a.state,
+    'num_upcoming_shows': a.upcoming_show_count,
+  }
+
+
+@api.route('/venues')
+def venues():
+  query = Venue.query
+  return _listing(query, venue_item, Venue.state, Venue.city, Venue.id)
+
+
+@api.route('/venues/<int:venue_id>')
+def venue(venue_id):
+  v = Venue.detail(venue_id)
+  if v is None:
+    abort(404)
+  return _json(_project(serializers.venue_detail(v, *v.timeline())))
+
+
+@api.route('/artists')
+def artists():
+  query = Artist.query
+  return _listing(query, artist_item, Artist.name, Artist.id)
+
+
+@api.route('/artists/<int:artist_id>')
+def artist(artist_id):
+  a = Artist.detail(artist_id)
+  if a is None:
+    abort(404)
+  return _json(_project(serializers.artist_detail(a, *a.timeline())))
+
+
+@api.route('/shows')
+def shows():
+  query = Show.window(**feeds.filters(request.args)) \
+    .options(joinedload(Show.venue), joinedload(Show.artist))
+  return _listing(query, serializers.show, Show.start_time, Show.id)
+
+
+@api.route('/shows/<int:show_id>')
+def show(show_id):
+  s = Show.query \
+    .options(joinedload(Show.venue), joinedload(Show.artist)) \
+    .get(show_id)
+  if s is None:
+    abort(404)
+  return _json(_project(serializers.show(s)))
+
+
+LOOKUPS = {'venues': Venue, 'artists': Artist}
+
+
+@api.route('/lookup/<kind>')
+def lookup(kind):
+  # id and name by name prefix, for the show form's autocomplete. the page
+  # cache drops these when a venue/artist changes, max-age is for the
+  # browser while someone types
+  if kind not in LOOKUPS:
+    abort(404)
+  response = make_response(_lookup(kind=kind))
+  response.cache_control.max_age = 60
+  return response
+
+
+@cached('{kind}')
+def _lookup(kind):
+  limit = max(1, min(request.args.get('limit', 10, type=int), current_app.config['MAX_PAGE_SIZE']))
+  rows = search.prefix(LOOKUPS[kind], request.args.get('q', '').strip(), limit)
+  return _json({'data': [{'id': id, 'name': name} for id, name in rows]})
+
+
+@api.route('/import/<kind>', methods=['POST'])
+def import_rows(kind):
+  # either a multipart upload in `file` or the raw body, streamed line by
+  # line rather than read into memory
+  if kind not in bulk.KINDS:
+    abort(404)
+  upload = request.files.get('file')
+  format = request.args.get('format') or bulk.guess_format(upload and upload.filename)
+  if format not in bulk.FORMATS:
+    abort(400, f'format must be one of {", ".join(bulk.FORMATS)}')
+  stream = upload.stream if upload else request.stream
+  report = bulk.import_rows(kind, bulk.read(codecs.iterdecode(stream, 'utf-8'), format))
+  return _json(report.as_dict())
+
+
+def is_api_request():
+  return request.path.startswith(api.url_prefix + '/')
+
+
+# the codes are listed too since flask prefers the app's own 404/500 pages
+# over a blueprint handler registered by class. these only cover routes the
+# blueprint matched; urls under /api/v1 that match nothing (404, 405) come
+# back here through the app's handlers in app.py, see is_api_request
+@api.errorhandler(400)
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def error(e):
+  response = _json({'error': {'code': e.code, 'message': e.description}}, e.code)
+  if getattr(e, 'valid_methods', None):
+    # a 405 says what would have worked
+    response.headers['Allow'] = ', '.join(e.valid_methods)
+  return response
+
+
+def _listing(query, serialize, *columns):
+  # ?ids=1,2,3 fetches a batch in one go, otherwise it's keyset paged like
+  # the html listings
+  ids = request.args.get('ids')
+  if ids is not None:
+    try:
+      ids = [int(i) for i in ids.split(',') if i]
+    except ValueError:
+      abort(400, 'ids must be a comma separated list of integers')
+    if len(ids) > current_app.config['MAX_PAGE_SIZE']:
+      abort(400, 'too many ids')
+    rows = query.filter(columns[-1].in_(ids)).order_by(*columns).all()
+    return _json({
+      'data': [_project(serialize(r)) for r in rows],
+      'missing': sorted(set(ids) - {r.id for r in rows}),
+    })
+  page = keyset(query, *columns)
+  return _json({
+    'data': [_project(serialize(r)) for r in page.items],
+    'links': {'next': page.next_url, 'prev': page.prev_url},
+  })
+
+
+def _project(item):
+  # sparse fieldsets: ?fields=id,name
+  fields = request.args.get('fields')
+  if not fields:
+    return item
+  wanted = set(fields.split(','))
+  return {k: v for k, v in item.items() if k in wanted}
+
+
+def _default(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  raise TypeError(f'{type(value).__name__} is not json serializable')
+
+
+def _json(data, status=200):
+  response = current_app.response_class(
+    json.dumps(data, default=_default),
+    status=status,
+    mimetype='application/json'
+  )
+  if status == 200:
+    # strong etag over the body. the queries still run, but a client that
+    # already has this answers with If-None-Match and gets an empty 304
+    response.add_etag()
+    response.make_conditional(request)
+  return response
@@ -5,128 +5,156 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, \
+  url_for, abort, current_app, jsonify, stream_with_context
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-import logging
-from logging import Formatter, FileHandler
+from datetime import datetime
+from functools import lru_cache
 from flask_wtf import Form
 from forms import *
-from itertools import groupby
+from sqlalchemy.orm import joinedload
 from sys import exc_info
-from models import init, transaction, Artist, Genre, Show, Venue
+from models import db, area_summary, transaction, Artist, Show, Venue
+from pagination import keyset
+from api import api, error as api_error, is_api_request
+from cache import cached, conditional
+import areas
+import assets
+import bulk
+import cache
+import catalog
+import counters
+import feeds
+import jobs
+import config
+import log
+import metrics
+import models
+import pool
+import scheduling
+import search
+import serializers
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-migrate = init(app)
+moment = Moment()
+pages = Blueprint('pages', __name__)
+
+
+def create_app(config_class=None, **settings):
+  # config_class defaults to the one FYYUR_ENV names, see config.py. settings
+  # override single values on top of it
+  app = Flask(__name__)
+  app.config.from_object(config_class or config.from_env())
+  app.config.update(settings)
+  if not app.config['SECRET_KEY']:
+    raise RuntimeError('SECRET_KEY (or SECRET_KEY_FILE) has to be set')
+  log.init(app)
+  moment.init_app(app)
+  pool.init(app)
+  models.init(app)
+  metrics.init(app)
+  cache.init(app)
+  bulk.init(app)
+  catalog.init(app)
+  areas.init(app)
+  counters.init(app)
+  jobs.init(app)
+  assets.init(app)
+  app.register_blueprint(pages)
+  app.register_blueprint(api)
+  return app
 
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
 
-app.jinja_env.filters['datetime'] = format_datetime
+@lru_cache(maxsize=None)
+def _datetime_pattern(format, locale):
+  pattern = DATETIME_FORMATS.get(format, format)
+  return babel.dates.parse_pattern(pattern), babel.Locale.parse(locale)
+
+# show tiles repeat the same handful of times all over a page
+@lru_cache(maxsize=4096)
+def format_datetime(value, format='medium', locale='en'):
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  pattern, locale = _datetime_pattern(format, locale)
+  return pattern.apply(value, locale)
+
+pages.add_app_template_filter(format_datetime, 'datetime')
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@pages.route('/')
 def index():
   return render_template('pages/home.html')
 
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@pages.route('/venues')
+@conditional(lambda: models.last_change(Venue, Show))
+@cached('venues')
 def venues():
-  orderedvenues = Venue.query.order_by(Venue.state, Venue.city)
-  venuesbycity = groupby(orderedvenues, lambda v: (v.state, v.city))
-  data = [{
-    'city': city,
-    'state': state,
-    'venues': [{
-      'id': v.id,
-      'name': v.name,
-      'num_upcoming_shows': len(v.upcoming_shows)
-    } for v in venues]
-  } for (state, city), venues in venuesbycity]
-  return render_template('pages/venues.html', areas=data);
+  # straight off the area summary, no Venue or Show rows involved
+  page = keyset(
+    db.session.query(area_summary),
+    area_summary.c.state, area_summary.c.city
+  )
+  return render_template('pages/venues.html', states=areas.page(page), page=page)
 
-@app.route('/venues/search', methods=['POST'])
+@pages.route('/venues/search', methods=['POST'])
 def search_venues():
   term = request.form.get('search_term', '')
-  found = Venue.query.filter(Venue.name.ilike(f'%{term}%')).all()
+  found = search.query(Venue, term).all()
   response = {
     'count': len(found),
     'data': [{
       'id': v.id,
       'name': v.name,
-      'num_upcoming_shows': len(v.upcoming_shows)
+      'num_upcoming_shows': v.upcoming_show_count
     } for v in found]
   }
   return render_template('pages/search_venues.html', results=response, search_term=term)
 
-@app.route('/venues/<int:venue_id>')
+@pages.route('/venues/<int:venue_id>')
+@conditional(lambda venue_id: Venue.last_modified(venue_id))
+@cached('venue:{venue_id}')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  venue = Venue.query.get(venue_id)
-  data = None if venue is None else {
-    'id': venue.id,
-    'name': venue.name,
-    'genres': [g.name for g in venue.genres],
-    'address': venue.address,
-    'city': venue.city,
-    'state': venue.state,
-    'phone': venue.phone,
-    'website': venue.website,
-    'facebook_link': venue.facebook_link,
-    'seeking_talent': venue.seeking_talent,
-    'seeking_description': venue.seeking_description,
-    'image_link': venue.image_link,
-    'past_shows': [{
-      'artist_id': s.artist.id,
-      'artist_name': s.artist.name,
-      'artist_image_link': s.artist.image_link,
-      'start_time': str(s.start_time)
-    } for s in venue.past_shows],
-    'upcoming_shows': [{
-      'artist_id': s.artist_id,
-      'artist_name': s.artist.name,
-      'artist_image_link': s.artist.image_link,
-      'start_time': str(s.start_time)
-    } for s in venue.upcoming_shows],
-    'past_shows_count': len(venue.past_shows),
-    'upcoming_shows_count': len(venue.upcoming_shows),
-  }
+  venue = Venue.detail(venue_id)
+  if venue is None:
+    abort(404)
+  past, upcoming = venue.timeline()
+  data = serializers.venue_detail(venue, past, upcoming)
   return render_template(
     'pages/show_venue.html',
     venue=data,
-    delete_url=url_for("delete_venue_from_the_90s", venue_id=venue.id)
+    delete_url=url_for('.delete_venue_from_the_90s', venue_id=venue.id)
   )
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@pages.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@pages.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   form = VenueForm()
   if not request.form['facebook_link']:
@@ -138,19 +166,19 @@ def create_venue_submission():
     if form.validate():
       with transaction() as sess:
         d = form.data
-        d['genres'] = Genre.query.filter(Genre.name.in_(d['genres'])).all()
+        d['genres'] = catalog.genres(d['genres'])
         d['website'] = d.pop('website_link')
         venue = Venue(**d)
         sess.add(venue)
         # on successful db insert, flash success
         flash(f'Venue {d["name"]} was successfully listed!')
-        return redirect(url_for("index"))
+        return redirect(url_for('.index'))
     flash('Unable to create venue due to invalid data', 'error')
     for field, errors in _join_errors(form):
       flash(f'{field}: {errors}', 'error')
   except:
     flash('Unable to create venue due to a backend error', 'error')
-    app.log_exception(exc_info())
+    current_app.log_exception(exc_info())
   return render_template('forms/new_venue.html', form=form)
 
 
@@ -162,7 +190,7 @@ def _delete(id):
     sess.delete(venue)
     return True, venue.name
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@pages.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   try:
     ok, error = _delete(venue_id)
@@ -170,77 +198,59 @@ def delete_venue(venue_id):
       return jsonify({'ok': True})
     return jsonify({'ok': False, 'reason': error}), 404
   except:
-    app.log_exception(exc_info())
+    current_app.log_exception(exc_info())
     return jsonify({'ok': False, 'reason': 'Server error'}), 500
 
-@app.route('/venues/without/<venue_id>', methods=['POST'])
+@pages.route('/venues/without/<venue_id>', methods=['POST'])
 def delete_venue_from_the_90s(venue_id):
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
   ok, result = _delete(venue_id)
   if ok:
     flash(f'Venue {result} deleted')
-    return redirect(url_for("index"))
+    return redirect(url_for('.index'))
   flash(f'Unable to delete venue: {result}', 'error')
-  return redirect(url_for("show_venue", venue_id=venue_id))
+  return redirect(url_for('.show_venue', venue_id=venue_id))
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@pages.route('/artists')
+@conditional(lambda: models.last_change(Artist))
+@cached('artists')
 def artists():
-  data = [{'id': a.id, 'name': a.name} for a in Artist.query.all()]
-  return render_template('pages/artists.html', artists=data)
+  page = keyset(Artist.query, Artist.name, Artist.id)
+  data = [{'id': a.id, 'name': a.name} for a in page.items]
+  return render_template('pages/artists.html', artists=data, page=page)
 
-@app.route('/artists/search', methods=['POST'])
+@pages.route('/artists/search', methods=['POST'])
 def search_artists():
   term = request.form.get('search_term', '')
-  found = Artist.query.filter(Artist.name.ilike(f'%{term}%')).all()
+  found = search.query(Artist, term).all()
   response = {
     'count': len(found),
     'data': [{
       'id': a.id,
       'name': a.name,
-      'num_upcoming_shows': len(a.upcoming_shows)
+      'num_upcoming_shows': a.upcoming_show_count
     } for a in found]
   }
   return render_template('pages/search_artists.html', results=response, search_term=term)
 
-@app.route('/artists/<int:artist_id>')
+@pages.route('/artists/<int:artist_id>')
+@conditional(lambda artist_id: Artist.last_modified(artist_id))
+@cached('artist:{artist_id}')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  a = Artist.query.get(artist_id)
-  data = None if a is None else {
-    'id': a.id,
-    'name': a.name,
-    'genres': [g.name for g in a.genres],
-    'city': a.city,
-    'state': a.state,
-    'phone': a.phone,
-    'website': a.website,
-    'facebook_link': a.facebook_link,
-    'seeking_venue': a.seeking_venue,
-    'seeking_description': a.seeking_description,
-    'image_link': a.image_link,
-    'past_shows': [{
-      'venue_id': s.venue.id,
-      'venue_name': s.venue.name,
-      'venue_image_link': s.venue.image_link,
-      'start_time': str(s.start_time)
-    } for s in a.past_shows],
-    'upcoming_shows': [{
-      'venue_id': s.venue.id,
-      'venue_name': s.venue.name,
-      'venue_image_link': s.venue.image_link,
-      'start_time': str(s.start_time)
-    } for s in a.upcoming_shows],
-    'past_shows_count': len(a.past_shows),
-    'upcoming_shows_count': len(a.upcoming_shows)
-  }
+  a = Artist.detail(artist_id)
+  if a is None:
+    abort(404)
+  past, upcoming = a.timeline()
+  data = serializers.artist_detail(a, past, upcoming)
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@pages.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   a = Artist.query.get(artist_id)
   artist = None if a is None else {
@@ -259,13 +269,13 @@ def edit_artist(artist_id):
   form = ArtistForm(data=artist)
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@pages.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   form = ArtistForm()
   artist = Artist.query.get(artist_id)
   if artist is None:
     flash(f'No such artist (id: {artist_id})')
-    return redirect(url_for("artists"))
+    return redirect(url_for('.artists'))
   if not request.form['facebook_link']:
     form.facebook_link.validators = []
   try:
@@ -274,19 +284,19 @@ def edit_artist_submission(artist_id):
       with transaction():
         form.populate_obj(artist)
         selected = request.form.getlist('genres')
-        artist.genres = Genre.query.filter(Genre.name.in_(selected)).all()
+        artist.genres = catalog.genres(selected)
         artist.website = request.form['website_link']
         flash(f'Updated info for artist {artist.name}')
-        return redirect(url_for('show_artist', artist_id=artist_id))
+        return redirect(url_for('.show_artist', artist_id=artist_id))
     flash('Unable to update artist due to invalid data', 'error')
     for field, errors in _join_errors(form):
       flash(f'{field}: {errors}', 'error')
   except:
     flash('Unable to update artist due to a backend error', 'error')
-    app.log_exception(exc_info())
+    current_app.log_exception(exc_info())
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@pages.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   v = Venue.query.get(venue_id)
   venue = None if v is None else {
@@ -306,13 +316,13 @@ def edit_venue(venue_id):
   form = VenueForm(data=venue)
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@pages.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   venue = Venue.query.get(venue_id)
   form = VenueForm()
   if venue is None:
     flash(f'No such venue (id: {venue_id})')
-    return redirect(url_for("venues"))
+    return redirect(url_for('.venues'))
   if not request.form['facebook_link']:
     form.facebook_link.validators = []
   try:
@@ -321,28 +331,28 @@ def edit_venue_submission(venue_id):
       with transaction():
         form.populate_obj(venue)
         selected = request.form.getlist('genres')
-        venue.genres = Genre.query.filter(Genre.name.in_(selected)).all()
+        venue.genres = catalog.genres(selected)
         venue.website = request.form['website_link']
         flash(f'Updated info for venue {venue.name}')
-        return redirect(url_for('show_venue', venue_id=venue_id))
+        return redirect(url_for('.show_venue', venue_id=venue_id))
     flash('Unable to update venue due to invalid data', 'error')
     for field, errors in _join_errors(form):
       flash(f'{field}: {errors}', 'error')
   except:
     flash('Unable to update venue due to a backend error', 'error')
-    app.log_exception(exc_info())
+    current_app.log_exception(exc_info())
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@pages.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@pages.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   form = ArtistForm()
   if not request.form['facebook_link']:
@@ -350,12 +360,12 @@ def create_artist_submission():
   if form.validate():
     with transaction() as sess:
       d = form.data
-      d['genres'] = Genre.query.filter(Genre.name.in_(d['genres'])).all()
+      d['genres'] = catalog.genres(d['genres'])
       d['website'] = d.pop('website_link')
       sess.add(Artist(**d))
       # on successful db insert, flash success
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
-      return redirect(url_for("index"))
+      return redirect(url_for('.index'))
   # TODO: on unsuccessful db insert, flash an error instead.
   # e.g., flash('An error occurred. Artist ' + data.name + ' could not be listed.')
   flash('Unable to create artist due to invalid data', 'error')
@@ -367,65 +377,102 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@pages.route('/shows')
+@conditional(lambda: models.last_change(Show, Venue, Artist))
+@cached('shows')
 def shows():
-  # displays list of shows at /shows
-  data = [{
-    'venue_id': s.venue.id,
-    'venue_name': s.venue.name,
-    'artist_id': s.artist.id,
-    'artist_name': s.artist.name,
-    'artist_image_link': s.artist.image_link,
-    'start_time': str(s.start_time)
-  } for s in Show.query.all()]
-  return render_template('pages/shows.html', shows=data)
-
-@app.route('/shows/create')
+  # displays list of shows at /shows, optionally narrowed down with
+  # ?from=&to=&city=&state=&genre=&venue=&artist=
+  window = feeds.filters(request.args)
+  page = keyset(
+    Show.window(**window).options(joinedload(Show.venue), joinedload(Show.artist)),
+    Show.start_time, Show.id
+  )
+  data = [serializers.show(s) for s in page.items]
+  return render_template(
+    'pages/shows.html',
+    shows=data,
+    page=page,
+    filters={k: request.args.get(k, '') for k in feeds.FILTERS},
+    genres=catalog.genre_choices(),
+    ical_url=url_for('.shows_ical', **request.args.to_dict()),
+  )
+
+@pages.route('/shows.ics')
+def shows_ical():
+  # subscribable calendar, upcoming shows unless ?from= says otherwise
+  window = feeds.filters(request.args)
+  window.setdefault('start', datetime.now())
+  return Response(
+    stream_with_context(feeds.ical(window, current_app.config['EXPORT_BATCH_SIZE'])),
+    mimetype='text/calendar',
+    headers={'Content-Disposition': 'inline; filename=shows.ics'}
+  )
+
+@pages.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@pages.route('/shows/create', methods=['POST'])
 def create_show_submission():
   form = ShowForm()
   try:
-    if form.validate():
+    if form.validate() and form.validate_references():
       # on successful db insert, flash success
       with transaction() as sess:
         d = form.data
-        d['artist_id'] = int(d['artist_id'])
-        d['venue_id'] = int(d['venue_id'])
-        sess.add(Show(**d))
-        flash('Show was successfully listed!')
-        return redirect(url_for("index"))
-    app.logger.info(form.data)
+        d['end_time'] = scheduling.end_time(d['start_time'], d['end_time'])
+        problem = scheduling.check_times(d['start_time'], d['end_time'])
+        problems = [problem] if problem else scheduling.conflicts(d)
+        if not problems:
+          sess.add(Show(**d))
+          flash('Show was successfully listed!')
+          return redirect(url_for('.index'))
+      for problem in problems:
+        flash(f'Unable to create show: {problem}', 'error')
+      return render_template('forms/new_show.html', form=form)
+    current_app.logger.info(form.data)
     flash('Unable to create show due to invalid data', 'error')
     for field, errors in _join_errors(form):
       flash(f'{field}: {errors}', 'error')
   except:
     flash('Unable to create show due to a backend error', 'error')
-    app.log_exception(exc_info())
+    current_app.log_exception(exc_info())
   return render_template('forms/new_show.html', form=form)
 
-@app.errorhandler(404)
+#  Export
+#  ----------------------------------------------------------------
+
+@pages.route('/export/<kind>.<format>')
+@pool.statement_timeout(60000)
+def export(kind, format):
+  if kind not in bulk.EXPORTS or format not in bulk.FORMATS:
+    abort(404)
+  mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+  return Response(
+    stream_with_context(bulk.export(kind, format)),
+    mimetype=mimetype,
+    headers={'Content-Disposition': f'attachment; filename={kind}.{format}'}
+  )
+
+@pages.app_errorhandler(404)
 def not_found_error(error):
+    if is_api_request():
+      return api_error(error)
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@pages.app_errorhandler(405)
+def method_not_allowed_error(error):
+    if is_api_request():
+      return api_error(error)
+    return error
+
+@pages.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 
 def _join_errors(form):
   for field, errors in form.errors.items():
@@ -435,13 +482,15 @@ def _join_errors(form):
 # Launch.
 #----------------------------------------------------------------------------#
 
+# `flask run` and `gunicorn 'app:create_app()'` both go through the factory.
+
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
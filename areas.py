@@ -0,0 +1,182 @@
+import zlib
+from itertools import groupby
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from models import db, area_summary, area_venues, note_changes, transaction, Venue
+# its before_commit listener has to go first, see the bottom
+import counters
+
+
+# the venues-by-area summary behind /venues. a commit that touches a venue or
+# any of its shows rewrites that venue's AreaVenue row and the Area totals
+# of its city, old and new, before it goes through, so the page never sees
+# the two out of step. the upcoming counts are copied off the Venue columns
+# counters.py keeps, rollover included: the counters.rollover job reports
+# the venues it recounts as changed, which lands them here too.
+
+CHUNK = 500
+
+_venue_columns = ['venue_id', 'state', 'city', 'name', 'upcoming_shows']
+_area_columns = ['state', 'city', 'venues', 'upcoming_shows']
+
+# pg_advisory_xact_lock(AREA_LOCK, crc of the area), see _lock
+AREA_LOCK = 0x41524541
+
+
+def _venue_rows(ids=None):
+  rows = db.select(
+    Venue.id,
+    db.func.coalesce(Venue.state, ''),
+    db.func.coalesce(Venue.city, ''),
+    db.func.coalesce(Venue.name, ''),
+    Venue.upcoming_show_count,
+  )
+  if ids is not None:
+    rows = rows.where(Venue.id.in_(ids))
+  return rows
+
+
+def _area_rows(keys=None):
+  av = area_venues.c
+  rows = db.select(av.state, av.city, db.func.count(), db.func.sum(av.upcoming_shows)) \
+    .group_by(av.state, av.city)
+  if keys is not None:
+    rows = rows.where(db.tuple_(av.state, av.city).in_(keys))
+  return rows
+
+
+def _chunks(items):
+  items = sorted(items)
+  for start in range(0, len(items), CHUNK):
+    yield items[start:start + CHUNK]
+
+
+def _upsert(sess, table, columns, rows, key):
+  # insert ... select, updating the rows that are there already. a delete
+  # and insert of the same keys instead races under read committed: a
+  # transaction whose delete skipped a row another one just replaced
+  # fails its insert on the primary key
+  dialect = sess.get_bind().dialect.name
+  if dialect == 'postgresql':
+    from sqlalchemy.dialects.postgresql import insert
+  elif dialect == 'sqlite':
+    from sqlalchemy.dialects.sqlite import insert
+  else:
+    # no upsert to go on, and no promises with concurrent writers either
+    pk = db.tuple_(*(table.c[c] for c in key))
+    picked = rows.subquery()
+    sess.execute(table.delete().where(pk.in_(
+      db.select(*(picked.c[n] for n in range(len(key))))
+    )))
+    sess.execute(table.insert().from_select(columns, rows))
+    return
+  stmt = insert(table).from_select(columns, rows)
+  sess.execute(stmt.on_conflict_do_update(
+    index_elements=key,
+    set_={c: stmt.excluded[c] for c in columns if c not in key},
+  ))
+
+
+def _lock(sess, keys):
+  # an area's totals are summed off AreaVenue rows other transactions may
+  # be changing too. on postgres one transaction at a time gets to recount
+  # an area, the others wait for it to commit and then see its rows. taken
+  # in one order everywhere so two commits can't wait on each other.
+  # sqlite only has one writer anyway
+  if sess.get_bind().dialect.name != 'postgresql':
+    return
+  for crc in sorted({zlib.crc32(f'{state}\0{city}'.encode()) & 0x7fffffff for state, city in keys}):
+    sess.execute(db.select(db.func.pg_advisory_xact_lock(AREA_LOCK, crc)))
+
+
+def refresh(sess, venue_ids):
+  av = area_venues.c
+  touched = set()
+  for ids in _chunks(venue_ids):
+    where = av.venue_id.in_(ids)
+    touched.update(tuple(k) for k in sess.execute(db.select(av.state, av.city).where(where)))
+    _upsert(sess, area_venues, _venue_columns, _venue_rows(ids), ['venue_id'])
+    # the ones deleted
+    sess.execute(area_venues.delete().where(where).where(
+      av.venue_id.not_in(db.select(Venue.id).where(Venue.id.in_(ids)))
+    ))
+    touched.update(tuple(k) for k in sess.execute(db.select(av.state, av.city).where(where)))
+  _lock(sess, touched)
+  area = db.tuple_(area_summary.c.state, area_summary.c.city)
+  for keys in _chunks(touched):
+    _upsert(sess, area_summary, _area_columns, _area_rows(keys), ['state', 'city'])
+    # and the ones left without a venue
+    sess.execute(area_summary.delete().where(area.in_(keys)).where(
+      area.not_in(db.select(av.state, av.city).where(db.tuple_(av.state, av.city).in_(keys)))
+    ))
+
+
+def rebuild(sess):
+  sess.execute(area_summary.delete())
+  sess.execute(area_venues.delete())
+  sess.execute(area_venues.insert().from_select(_venue_columns, _venue_rows()))
+  sess.execute(area_summary.insert().from_select(_area_columns, _area_rows()))
+
+
+def page(query_page):
+  # one query for the venues of every area on the page, handed back grouped
+  # by state for the collapsible sections
+  keys = [(a.state, a.city) for a in query_page.items]
+  listed = {}
+  if keys:
+    av = area_venues.c
+    for row in db.session.execute(
+        db.select(av.state, av.city, av.venue_id, av.name, av.upcoming_shows)
+        .where(db.tuple_(av.state, av.city).in_(keys))
+        .order_by(av.state, av.city, av.name, av.venue_id)):
+      listed.setdefault((row.state, row.city), []).append({
+        'id': row.venue_id,
+        'name': row.name,
+        'num_upcoming_shows': row.upcoming_shows,
+      })
+  return [{
+    'state': state,
+    'areas': [{
+      'city': a.city,
+      'state': a.state,
+      'num_venues': a.venues,
+      'num_upcoming_shows': a.upcoming_shows,
+      'venues': listed.get((a.state, a.city), []),
+    } for a in rows],
+  } for state, rows in groupby(query_page.items, lambda a: a.state)]
+
+
+def _maintain(sess):
+  # flushing first so the changes include whatever is still pending
+  sess.flush()
+  ids = {id for model, id in sess.info.get('changes', ()) if model is Venue and id is not None}
+  if ids:
+    refresh(sess, ids)
+
+
+@click.group('areas')
+def areas_command():
+  """The venues-by-area summary behind /venues."""
+
+
+@areas_command.command('rebuild')
+@with_appcontext
+def rebuild_command():
+  """Recount the Venue shows and rebuild it from scratch off them."""
+  with transaction() as sess:
+    counters.rebuild(sess)
+    rebuild(sess)
+    # for the page cache. no id, so _maintain leaves it alone
+    note_changes(sess, {(Venue, None)})
+    n = sess.query(area_venues).count()
+  click.echo(f'{n} venues rebuilt')
+
+
+def init(app):
+  app.cli.add_command(areas_command)
+
+
+# after counters._maintain, registered when counters was imported above, so
+# the counts copied are the ones this commit leaves
+event.listen(db.session, 'before_commit', _maintain)
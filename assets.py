@@ -0,0 +1,365 @@
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import posixpath
+import re
+from mimetypes import guess_type
+import click
+from flask import Blueprint, current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+
+# `flask assets build` turns static/ into static/dist/: the bundles below
+# concatenated and minified, every file renamed after a hash of what's in it,
+# text files gzipped (and brotli'd, with the brotli package) next to
+# themselves, the icon font subset (with fonttools) and the splash resized
+# (with pillow). a hashed name never gets
+# different contents, so /assets/ serves them to be cached for a year.
+#
+# a build only adds to static/dist/, the workers still on the previous one
+# keep finding their files there. `flask assets prune` deletes what none of
+# the last few builds use
+#
+# templates go through asset_url/asset_urls/asset_srcset, which fall back on
+# the plain /static/ files when there's no build or USE_ASSET_BUILD is off
+
+BUNDLES = {
+  'css/app.css': [
+    'css/bootstrap.min.css',
+    'css/icons.css',
+    'css/layout.main.css',
+    'css/main.css',
+    'css/main.responsive.css',
+    'css/main.quickfix.css',
+  ],
+  'js/app.js': [
+    'js/libs/jquery-1.11.1.min.js',
+    'js/libs/bootstrap-3.1.1.min.js',
+    'js/plugins.js',
+    'js/script.js',
+  ],
+}
+
+# widths to resize to, on top of the original's own
+IMAGES = {
+  'img/front-splash.jpg': (480, 960, 1440),
+}
+
+# icon fonts cut down to the glyphs their stylesheet has a `content:` for,
+# with fonttools
+SUBSETS = {
+  'fonts/fontawesome-webfont.woff': 'css/icons.css',
+  'fonts/fontawesome-webfont.ttf': 'css/icons.css',
+}
+
+# woff, woff2 and images are compressed already
+COMPRESS = ('.css', '.js', '.svg', '.ttf', '.eot', '.otf', '.json')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# what the build makes do without, per missing package. all of them are in
+# requirements-build.txt
+OPTIONAL = {
+  'brotli': ('brotli', 'no .br files'),
+  'fontTools': ('fonttools', 'the icon fonts go out whole'),
+  'PIL': ('Pillow', 'no resized images'),
+  'rjsmin': ('rjsmin', 'our own scripts go out unminified'),
+}
+
+assets = Blueprint('assets', __name__)
+
+
+def dist_folder(app):
+  return os.path.join(app.static_folder, 'dist')
+
+
+class Build:
+  def __init__(self, static, out):
+    self.static = static
+    self.out = out
+    self.files = {}
+    self.srcset = {}
+    try:
+      import brotli
+    except ImportError:
+      brotli = None
+    self.brotli = brotli
+    self.missing = [
+      OPTIONAL[module] for module in OPTIONAL if importlib.util.find_spec(module) is None
+    ]
+
+  def run(self):
+    os.makedirs(self.out, exist_ok=True)
+    # single files first, the bundles point at the hashed fonts and images
+    for path in self.sources():
+      with open(os.path.join(self.static, path), 'rb') as f:
+        self.files[path] = self.write(path, f.read())
+    for font, stylesheet in SUBSETS.items():
+      self.subset(font, stylesheet)
+    for path, widths in IMAGES.items():
+      self.resize(path, widths)
+    for name, parts in BUNDLES.items():
+      if name.endswith('.css'):
+        text = ''.join(minify_css(self.rebase(name, part)) for part in parts)
+      else:
+        text = ';\n'.join(minify_js(part, self.read(part)) for part in parts)
+      self.files[name] = self.write(name, text.encode('utf-8'))
+    manifest = {'files': self.files, 'srcset': self.srcset}
+    manifest['hash'] = manifest_hash(manifest)
+    # one copy per build for prune to go by, and the one the app loads,
+    # swapped in whole
+    data = json.dumps(manifest, indent=1, sort_keys=True)
+    for name in (f'manifest.{manifest["hash"]}.json', 'manifest.json'):
+      with open(os.path.join(self.out, name + '.tmp'), 'w') as f:
+        f.write(data)
+      os.replace(os.path.join(self.out, name + '.tmp'), os.path.join(self.out, name))
+    return manifest
+
+  def sources(self):
+    for root, dirs, names in os.walk(self.static):
+      dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != self.out)
+      for name in sorted(names):
+        if not name.startswith('.'):
+          yield os.path.relpath(os.path.join(root, name), self.static).replace(os.sep, '/')
+
+  def read(self, path):
+    with open(os.path.join(self.static, path), encoding='utf-8') as f:
+      return f.read()
+
+  def write(self, path, data):
+    root, ext = posixpath.splitext(path)
+    hashed = f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    target = os.path.join(self.out, hashed)
+    if os.path.exists(target):
+      # an earlier build's, and the same bytes. maybe being served right now
+      return hashed
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+      f.write(data)
+    if ext in COMPRESS and len(data) > 1024:
+      self.compressed(target + '.gz', gzip.compress(data, 9, mtime=0), data)
+      if self.brotli:
+        self.compressed(target + '.br', self.brotli.compress(data), data)
+    return hashed
+
+  def compressed(self, target, data, original):
+    # only worth a file if it saves something
+    if len(data) < len(original) * 0.9:
+      with open(target, 'wb') as f:
+        f.write(data)
+
+  def rebase(self, name, part):
+    # url()s in the stylesheets are relative to their own folder; point them
+    # at the hashed copies, relative to where the bundle ends up
+    here = posixpath.dirname(part)
+    def replace(match):
+      url = match.group(2)
+      if re.match(r'([a-z]+:|/|#)', url):
+        return match.group(0)
+      path, rest = re.match(r'([^?#]*)(.*)', url).groups()
+      target = self.files.get(posixpath.normpath(posixpath.join(here, path)))
+      if target is None:
+        return match.group(0)
+      return f'url("{posixpath.relpath(target, posixpath.dirname(name))}{rest}")'
+    return re.sub(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''', replace, self.read(part))
+
+  def subset(self, font, stylesheet):
+    try:
+      from fontTools import subset
+    except ImportError:
+      return
+    codepoints = [
+      int(c, 16) for c in re.findall(r'content:\s*"\\([0-9a-f]+)"', self.read(stylesheet))
+    ]
+    options = subset.Options()
+    options.flavor = 'woff' if font.endswith('.woff') else None
+    # font-forge leftovers fonttools doesn't know
+    options.drop_tables += ['FFTM', 'webf']
+    loaded = subset.load_font(os.path.join(self.static, font), options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(loaded)
+    data = io.BytesIO()
+    subset.save_font(loaded, data, options)
+    loaded.close()
+    self.files[font] = self.write(font, data.getvalue())
+
+  def resize(self, path, widths):
+    try:
+      from PIL import Image
+    except ImportError:
+      return
+    root, ext = posixpath.splitext(path)
+    with Image.open(os.path.join(self.static, path)) as image:
+      found = []
+      for width in sorted(widths):
+        if width >= image.width:
+          continue
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        data = io.BytesIO()
+        resized.save(data, image.format, quality=80, optimize=True, progressive=True)
+        variant = f'{root}-{width}{ext}'
+        self.files[variant] = self.write(variant, data.getvalue())
+        found.append((width, variant))
+      found.append((image.width, path))
+    self.srcset[path] = found
+
+
+def manifest_hash(manifest):
+  # names a build: the same files, the same hash
+  data = json.dumps([manifest['files'], manifest['srcset']], sort_keys=True)
+  return hashlib.sha256(data.encode('utf-8')).hexdigest()[:12]
+
+
+MANIFEST = re.compile(r'manifest\.[0-9a-f]+\.json')
+
+
+def prune(out, keep):
+  # deletes the files in out that none of the last `keep` builds use, and
+  # those builds' manifests. returns the paths removed, relative to out
+  manifests = sorted(
+    (name for name in os.listdir(out) if MANIFEST.fullmatch(name)),
+    key=lambda name: os.path.getmtime(os.path.join(out, name)), reverse=True,
+  )
+  used = {'manifest.json'}
+  for name in manifests[:keep] + ['manifest.json']:
+    path = os.path.join(out, name)
+    if os.path.exists(path):
+      used.add(name)
+      with open(path) as f:
+        used.update(json.load(f)['files'].values())
+  removed = []
+  for root, dirs, names in os.walk(out, topdown=False):
+    for name in names:
+      path = os.path.relpath(os.path.join(root, name), out).replace(os.sep, '/')
+      original = path[:-3] if path.endswith(('.gz', '.br')) else path
+      if path not in used and original not in used:
+        os.remove(os.path.join(root, name))
+        removed.append(path)
+    if root != out and not os.listdir(root):
+      os.rmdir(root)
+  return sorted(removed)
+
+
+def minify_css(text):
+  text = re.sub(r'/\*(?!!).*?\*/', '', text, flags=re.S)
+  text = re.sub(r'\s+', ' ', text)
+  # not around ':', `a :hover` and `a:hover` are different selectors
+  text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+  text = re.sub(r': ', ':', text)
+  return text.replace(';}', '}').strip() + '\n'
+
+
+def minify_js(path, text):
+  # the libraries come minified; our own scripts go through rjsmin if it's
+  # installed and as they are otherwise
+  if path.endswith('.min.js'):
+    return text
+  try:
+    from rjsmin import jsmin
+  except ImportError:
+    return text
+  return jsmin(text)
+
+
+def load(app):
+  path = os.path.join(dist_folder(app), 'manifest.json')
+  if not app.config.get('USE_ASSET_BUILD') or not os.path.exists(path):
+    return None
+  with open(path) as f:
+    manifest = json.load(f)
+  # builds from before the hash went in
+  manifest.setdefault('hash', manifest_hash(manifest))
+  return manifest
+
+
+def _manifest():
+  return current_app.extensions.get('assets')
+
+
+def asset_url(filename):
+  # url_for('static', filename=...) for a build
+  manifest = _manifest()
+  if manifest and filename in manifest['files']:
+    return url_for('assets.dist', filename=manifest['files'][filename])
+  return url_for('static', filename=filename)
+
+
+def asset_urls(bundle):
+  # one url for a built bundle, one per part without a build
+  manifest = _manifest()
+  if manifest and bundle in manifest['files']:
+    return [asset_url(bundle)]
+  return [url_for('static', filename=part) for part in BUNDLES[bundle]]
+
+
+def asset_srcset(filename):
+  manifest = _manifest()
+  if not manifest:
+    return ''
+  return ', '.join(
+    f'{asset_url(variant)} {width}w'
+    for width, variant in manifest['srcset'].get(filename, ())
+  )
+
+
+@assets.route('/assets/<path:filename>')
+def dist(filename):
+  # a proxy in front can serve static/dist itself (with gzip_static and the
+  # same Cache-Control); this is for when there isn't one
+  folder = dist_folder(current_app)
+  mimetype = guess_type(filename)[0]
+  for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+    if request.accept_encodings[encoding] and os.path.isfile(os.path.join(folder, filename + suffix)):
+      response = send_from_directory(folder, filename + suffix, mimetype=mimetype)
+      response.headers['Content-Encoding'] = encoding
+      break
+  else:
+    response = send_from_directory(folder, filename, mimetype=mimetype)
+  response.vary.add('Accept-Encoding')
+  response.headers['Cache-Control'] = IMMUTABLE
+  return response
+
+
+@click.group('assets')
+def assets_command():
+  """Build static/dist."""
+
+
+@assets_command.command('build')
+@click.option('--strict', is_flag=True,
+              help="Fail rather than build without one of requirements-build.txt.")
+@with_appcontext
+def build_command(strict):
+  """Bundle, hash and compress static/ into static/dist."""
+  app = current_app._get_current_object()
+  build = Build(app.static_folder, dist_folder(app))
+  for package, without in build.missing:
+    message = f'{package} is not installed: {without}'
+    if strict:
+      raise click.ClickException(f'{message}. pip install -r requirements-build.txt')
+    click.secho(f'warning: {message}', fg='yellow', err=True)
+  manifest = build.run()
+  click.echo(f'{len(manifest["files"])} files written to {dist_folder(app)}')
+
+
+@assets_command.command('prune')
+@click.option('--keep', type=click.IntRange(1), default=2, show_default=True,
+              help='How many of the latest builds to keep the files of.')
+@with_appcontext
+def prune_command(keep):
+  """Delete the files in static/dist older builds left behind."""
+  removed = prune(dist_folder(current_app), keep)
+  click.echo(f'{len(removed)} files removed from {dist_folder(current_app)}')
+
+
+def init(app):
+  app.extensions['assets'] = load(app)
+  app.register_blueprint(assets)
+  app.add_template_global(asset_url)
+  app.add_template_global(asset_urls)
+  app.add_template_global(asset_srcset)
+  app.cli.add_command(assets_command)
@@ -0,0 +1,58 @@
+"""Per-tile cost of the `datetime` template filter, the old string round trip
+through dateutil against the current one.
+
+    python -m bench.datetime_filter --tiles 300 --pages 20
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+import babel.dates
+import dateutil.parser
+
+
+def string_round_trip(value, format='medium'):
+  # what the filter used to do with str(show.start_time)
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+    format = "EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+    format = "EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def main():
+  p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  p.add_argument('--tiles', type=int, default=300, help='shows per page')
+  p.add_argument('--pages', type=int, default=20, help='page renders')
+  p.add_argument('--distinct', type=int, default=100,
+                 help='distinct start times among the tiles')
+  args = p.parse_args()
+
+  from app import format_datetime
+  rng = random.Random(0)
+  now = datetime.now().replace(minute=0, second=0, microsecond=0)
+  times = [now + timedelta(hours=rng.randint(-5000, 5000)) for _ in range(args.distinct)]
+  tiles = [rng.choice(times) for _ in range(args.tiles)]
+  strings = [str(t) for t in tiles]
+
+  def before():
+    for s in strings:
+      string_round_trip(s, 'full')
+
+  def after():
+    for t in tiles:
+      format_datetime(t, 'full')
+
+  def after_cold():
+    format_datetime.cache_clear()
+    after()
+
+  n = args.tiles * args.pages
+  for label, fn in (('before', before), ('after, cold', after_cold), ('after, warm', after)):
+    total = timeit.timeit(fn, number=args.pages)
+    print(f'{label:12} {total / n * 1e6:8.2f} us/tile  {total / args.pages * 1e3:8.2f} ms/page')
+
+
+if __name__ == '__main__':
+  main()
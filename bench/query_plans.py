@@ -0,0 +1,94 @@
+"""Shows query plans and timings for the show/genre lookups with and without
+the foreign key indexes.
+
+    python -m bench.query_plans --db sqlite:////tmp/fyyur.db --create --seed-data
+"""
+import random
+import time
+from datetime import datetime
+from models import db, artist_genres, venue_genres, Show, Venue
+from bench.seed import app_for, parser, seed
+
+
+INDEXES = (
+  'ix_Show_venue_id_start_time',
+  'ix_Show_artist_id_start_time',
+  'ix_VenueGenre_venue_id_genre_id',
+  'ix_ArtistGenre_artist_id_genre_id',
+)
+
+QUERIES = [
+  ('venue timeline',
+   'select * from "Show" where venue_id = :venue order by start_time'),
+  ('artist timeline',
+   'select * from "Show" where artist_id = :artist order by start_time'),
+  ('venue upcoming count',
+   'select count(*) from "Show" where venue_id = :venue and start_time >= :now'),
+  ('venue genres',
+   'select genre_id from "VenueGenre" where venue_id = :venue'),
+  ('artist genres',
+   'select genre_id from "ArtistGenre" where artist_id = :artist'),
+  ('venue delete cascade',
+   'delete from "Show" where venue_id = :venue'),
+]
+
+
+def indexes():
+  tables = (Show.__table__, venue_genres, artist_genres)
+  return [i for t in tables for i in t.indexes if i.name in INDEXES]
+
+
+def explain(conn, sql, params):
+  prefix = 'explain query plan ' if conn.dialect.name == 'sqlite' else 'explain '
+  rows = conn.execute(db.text(prefix + sql), params).fetchall()
+  # sqlite puts the detail in the last column, postgres has just the one
+  return [str(r[-1]) for r in rows]
+
+
+def timing(conn, sql, params, runs=20):
+  start = time.perf_counter()
+  for _ in range(runs):
+    conn.execute(db.text(sql), params).fetchall()
+  return (time.perf_counter() - start) / runs * 1000
+
+
+def report(conn, params):
+  for name, sql in QUERIES:
+    print(f'  {name}')
+    for line in explain(conn, sql, params):
+      print(f'      {line}')
+    if sql.startswith('select'):
+      print(f'      ~{timing(conn, sql, params):.3f} ms')
+
+
+def main():
+  p = parser()
+  p.add_argument('--seed-data', dest='seed_data', action='store_true',
+                 help='seed before measuring')
+  args = p.parse_args()
+  with app_for(args.db).app_context():
+    if args.create:
+      db.create_all()
+    if args.seed_data:
+      seed(args.venues, args.artists, args.shows, random.Random(args.seed),
+           cities=args.cities)
+    conn = db.session.connection()
+    params = {
+      'venue': db.session.query(db.func.max(Venue.id)).scalar(),
+      'artist': db.session.query(db.func.max(Show.artist_id)).scalar(),
+      'now': datetime.now(),
+    }
+    print(f'{Show.query.count()} shows on {conn.dialect.name}')
+    for label, apply in (('without', 'drop'), ('with', 'create')):
+      for index in indexes():
+        getattr(index, apply)(conn, checkfirst=True)
+      conn.execute(db.text('analyze'))
+      print(f'\n{label} fk indexes:')
+      report(conn, params)
+    # it all ran in one transaction, so this puts the indexes back the way
+    # they were
+    db.session.rollback()
+
+
+if __name__ == '__main__':
+  main()
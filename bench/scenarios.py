@@ -0,0 +1,145 @@
+"""Runs scripted page loads through the test client and reports latency,
+queries per request and memory for each.
+
+    python -m bench.seed --db sqlite:////tmp/fyyur.db --create
+    python -m bench.scenarios --db sqlite:////tmp/fyyur.db --requests 200 \\
+        --check bench/budgets.json
+
+With --check the run fails (exit status 1) when a scenario goes over the p95
+or queries per request it is allowed in the budget file.
+"""
+import json
+import random
+import re
+import sys
+import time
+import tracemalloc
+from models import db, Artist, Venue
+from bench.seed import CITIES, app_for, parser
+
+
+def _ids(model):
+  return [id for id, in db.session.query(model.id)]
+
+
+def scenarios(rng):
+  venue_ids, artist_ids = _ids(Venue), _ids(Artist)
+  terms = [c.split()[0] for c, _ in CITIES] + ['jazz', 'rock', 'venue 1', 'artist 2']
+  pages = {}
+
+  def walk(path):
+    # first page, then follow the next links so deep pages get measured too
+    def get(client):
+      response = client.get(pages.get(path) or path)
+      match = re.search(rb'<li class="next"><a href="([^"]+)"', response.data)
+      pages[path] = match and match.group(1).decode().replace('&amp;', '&')
+      return response
+    return get
+
+  def revisit(path):
+    # a repeat visitor sending back the ETag of its first load
+    etag = {}
+    def get(client):
+      response = client.get(path, headers={'If-None-Match': etag.get(path, '')})
+      etag.setdefault(path, response.headers.get('ETag'))
+      return response
+    return get
+
+  return [
+    ('venues listing', walk('/venues')),
+    ('artists listing', walk('/artists')),
+    ('shows listing', walk('/shows')),
+    ('venue detail', lambda c: c.get(f'/venues/{rng.choice(venue_ids)}')),
+    ('artist detail', lambda c: c.get(f'/artists/{rng.choice(artist_ids)}')),
+    ('venue detail revisited', revisit(f'/venues/{rng.choice(venue_ids)}')),
+    ('venue search', lambda c: c.post('/venues/search', data={'search_term': rng.choice(terms)})),
+    ('artist search', lambda c: c.post('/artists/search', data={'search_term': rng.choice(terms)})),
+    ('api venues', lambda c: c.get('/api/v1/venues')),
+  ]
+
+
+def _queries(response):
+  # metrics.py puts the count in Server-Timing
+  match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+  return int(match.group(1)) if match else 0
+
+
+def _percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(client, name, request, n, warmup):
+  for _ in range(warmup):
+    request(client)
+  times, queries = [], []
+  tracemalloc.reset_peak()
+  base = tracemalloc.get_traced_memory()[0]
+  for _ in range(n):
+    start = time.perf_counter()
+    response = request(client)
+    times.append((time.perf_counter() - start) * 1000)
+    if response.status_code not in (200, 304):
+      raise SystemExit(f'{name}: {response.status_code} from {response.request.path}')
+    queries.append(_queries(response))
+  return {
+    'scenario': name,
+    'p50_ms': round(_percentile(times, 50), 2),
+    'p95_ms': round(_percentile(times, 95), 2),
+    'queries': max(queries),
+    'peak_kib': round((tracemalloc.get_traced_memory()[1] - base) / 1024, 1),
+  }
+
+
+def check(results, budgets):
+  failures = []
+  for r in results:
+    budget = budgets.get(r['scenario'], {})
+    for key in ('p95_ms', 'queries', 'peak_kib'):
+      if key in budget and r[key] > budget[key]:
+        failures.append(f'{r["scenario"]}: {key} {r[key]} over {budget[key]}')
+  return failures
+
+
+def main():
+  p = parser()
+  p.description = __doc__.splitlines()[0]
+  p.add_argument('--requests', type=int, default=100, help='per scenario')
+  p.add_argument('--warmup', type=int, default=5)
+  p.add_argument('--only', help='run just the scenarios with this in their name')
+  p.add_argument('--cache', action='store_true',
+                 help='leave the page cache on, by default every request misses')
+  p.add_argument('--check', metavar='BUDGETS', help='json file of limits per scenario')
+  p.add_argument('--json', metavar='FILE', help='also write the results here')
+  args = p.parse_args()
+
+  settings = {} if args.cache else {'CACHE_BACKEND': None}
+  # keep the over budget warnings out of the numbers, --check covers them
+  app = app_for(args.db, QUERY_BUDGET=None, **settings)
+  results = []
+  tracemalloc.start()
+  with app.app_context():
+    client = app.test_client()
+    for name, request in scenarios(random.Random(args.seed)):
+      if args.only and args.only not in name:
+        continue
+      results.append(run(client, name, request, args.requests, args.warmup))
+      r = results[-1]
+      print(f'{name:22} p50 {r["p50_ms"]:8.2f} ms  p95 {r["p95_ms"]:8.2f} ms  '
+            f'{r["queries"]:3} queries  {r["peak_kib"]:9.1f} KiB peak')
+  tracemalloc.stop()
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent=2)
+  if args.check:
+    with open(args.check) as f:
+      failures = check(results, json.load(f))
+    for failure in failures:
+      print(failure, file=sys.stderr)
+    if failures:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,139 @@
+"""Fills the database with synthetic venues, artists and shows.
+
+    python -m bench.seed --db sqlite:////tmp/fyyur.db --create \\
+        --venues 1000 --artists 2000 --shows 100000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from models import db, transaction, Artist, Genre, Show, Venue
+from scheduling import DEFAULT_DURATION, MAX_DURATION, IntervalIndex
+import areas
+import counters
+
+
+GENRES = "Jazz,Reggae,Swing,Classical,Folk,Rock n Roll,R&B,Hip-Hop,Alternative,Blues," \
+  "Country,Electronic,Funk,Heavy Metal,Instrumental,Musical Theatre,Pop,Punk,Soul,Other"
+
+CITIES = [
+  ('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'),
+  ('Brooklyn', 'NY'), ('Austin', 'TX'), ('Houston', 'TX'), ('Chicago', 'IL'),
+  ('Seattle', 'WA'), ('Portland', 'OR'), ('Nashville', 'TN'),
+  ('New Orleans', 'LA'), ('Denver', 'CO'),
+]
+
+
+def seed(venues, artists, shows, rng=None, chunk=1000, cities=len(CITIES)):
+  rng = rng or random.Random(0)
+  cities = more_cities(cities, rng)
+  genres = Genre.query.all()
+  if not genres:
+    genres = [Genre(name=g) for g in GENRES.split(',')]
+    db.session.add_all(genres)
+    db.session.commit()
+
+  def venue(i):
+    city, state = rng.choice(cities)
+    return Venue(
+      name=f'Venue {i}', city=city, state=state, address=f'{i} Main St',
+      phone='555-000-0000', seeking_talent=rng.random() < 0.3,
+      genres=rng.sample(genres, rng.randint(1, 4))
+    )
+
+  def artist(i):
+    city, state = rng.choice(cities)
+    return Artist(
+      name=f'Artist {i}', city=city, state=state, phone='555-000-0000',
+      seeking_venue=rng.random() < 0.3,
+      genres=rng.sample(genres, rng.randint(1, 3))
+    )
+
+  venue_ids = _add_all(venue, venues, chunk)
+  artist_ids = _add_all(artist, artists, chunk)
+
+  # shows have no orm side effects so they skip the unit of work entirely
+  now = datetime.now().replace(minute=0, second=0, microsecond=0)
+  booked = {'venue_id': IntervalIndex(MAX_DURATION), 'artist_id': IntervalIndex(MAX_DURATION)}
+
+  def show():
+    # redraw until neither side is double booked
+    while True:
+      start_time = now + timedelta(hours=rng.randint(-24 * 365, 24 * 365))
+      row = {
+        'venue_id': rng.choice(venue_ids),
+        'artist_id': rng.choice(artist_ids),
+        'start_time': start_time,
+        'end_time': start_time + DEFAULT_DURATION,
+      }
+      if not any(booked[k].overlapping(row[k], start_time, row['end_time']) for k in booked):
+        for k in booked:
+          booked[k].add(row[k], start_time, row['end_time'])
+        return row
+
+  table = Show.__table__
+  for start in range(0, shows, chunk):
+    db.session.execute(table.insert(), [
+      show() for _ in range(start, min(start + chunk, shows))
+    ])
+    db.session.commit()
+  # and the /venues summary and show counts they skipped, in one go
+  with transaction() as sess:
+    counters.rebuild(sess)
+    areas.rebuild(sess)
+  return venue_ids, artist_ids
+
+
+def more_cities(n, rng):
+  # the real ones first, then made up towns spread over their states
+  states = sorted({s for _, s in CITIES})
+  return CITIES[:n] + [(f'Town {i}', rng.choice(states)) for i in range(len(CITIES), n)]
+
+
+def _add_all(make, n, chunk):
+  # through the orm so the search documents get built
+  ids = []
+  for start in range(0, n, chunk):
+    batch = [make(i) for i in range(start, min(start + chunk, n))]
+    with transaction() as sess:
+      sess.add_all(batch)
+      sess.flush()
+      ids += [e.id for e in batch]
+  return ids
+
+
+def parser():
+  p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  p.add_argument('--db', help='database url, defaults to the configured one')
+  p.add_argument('--create', action='store_true', help='create the tables first')
+  p.add_argument('--venues', type=int, default=200)
+  p.add_argument('--artists', type=int, default=400)
+  p.add_argument('--shows', type=int, default=10000)
+  p.add_argument('--cities', type=int, default=len(CITIES),
+                 help='distinct cities, made up past the built in ones')
+  p.add_argument('--seed', type=int, default=0, help='rng seed')
+  return p
+
+
+def app_for(url=None, **settings):
+  from app import create_app
+  import config
+  if url:
+    settings['SQLALCHEMY_DATABASE_URI'] = url
+  # a scratch database on a dev box, no SECRET_KEY needed unless FYYUR_ENV
+  # says otherwise
+  return create_app(config.from_env('development'), **settings)
+
+
+def main():
+  args = parser().parse_args()
+  with app_for(args.db).app_context():
+    if args.create:
+      db.create_all()
+    seed(args.venues, args.artists, args.shows, random.Random(args.seed),
+         cities=args.cities)
+    print(f'{Venue.query.count()} venues, {Artist.query.count()} artists, '
+          f'{Show.query.count()} shows')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,321 @@
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+from forms import ArtistForm, ShowForm, VenueForm
+from models import db, artist_genres, note_changes, transaction, venue_genres, \
+  Artist, Genre, Show, Venue
+from config import FALSE
+import catalog
+import scheduling
+
+
+# bulk loading for promoters. rows go through the same forms as the web
+# pages, then get written a chunk per transaction. a bad row is reported and
+# skipped, it doesn't take the rest of the file down with it.
+#
+# exports go the other way in the same columns, so a file can be fed back
+# in. they stream off a server side cursor a batch at a time.
+
+FORMATS = ('csv', 'jsonl')
+
+
+class Report:
+  def __init__(self):
+    self.imported = 0
+    self.errors = []
+
+  def error(self, row, message):
+    self.errors.append((row, message))
+
+  def as_dict(self):
+    return {
+      'imported': self.imported,
+      'rejected': len(self.errors),
+      'errors': [{'row': n, 'message': m} for n, m in sorted(self.errors)],
+    }
+
+
+def guess_format(filename):
+  ext = (filename or '').rpartition('.')[2].lower()
+  return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(ext)
+
+
+def read(lines, format):
+  # yields (row number, dict). a jsonl line that doesn't parse comes through
+  # as the exception instead, to be reported against its row
+  if format == 'csv':
+    yield from enumerate(csv.DictReader(lines), 1)
+  elif format == 'jsonl':
+    n = 0
+    for line in lines:
+      if not line.strip():
+        continue
+      n += 1
+      try:
+        yield n, json.loads(line)
+      except ValueError as e:
+        yield n, e
+  else:
+    raise ValueError(f'unknown format {format!r}')
+
+
+def import_rows(kind, rows, chunk_size=None):
+  form, check, save = KINDS[kind]
+  chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+  report = Report()
+  rows = iter(rows)
+  while True:
+    chunk = list(islice(rows, chunk_size))
+    if not chunk:
+      return report
+    records = []
+    for n, row in chunk:
+      data, error = _validate(form, row)
+      if error:
+        report.error(n, error)
+      else:
+        records.append((n, data))
+    records = check(records, report)
+    if not _save(save, records, report):
+      # something in the chunk upset the db. go again a row at a time so
+      # only the culprits get rejected
+      for record in records:
+        _save(save, [record], report)
+
+
+def _save(save, records, report):
+  if not records:
+    return True
+  try:
+    with transaction() as sess:
+      save(sess, records)
+  except SQLAlchemyError as e:
+    if len(records) > 1:
+      return False
+    report.error(records[0][0], f'could not be saved: {getattr(e, "orig", None) or e}')
+    return True
+  report.imported += len(records)
+  return True
+
+
+def _validate(form_class, row):
+  if isinstance(row, Exception):
+    return None, f'unreadable row: {row}'
+  if not isinstance(row, dict):
+    return None, 'not an object'
+  form = form_class(formdata=_formdata(row), meta={'csrf': False})
+  if 'facebook_link' in form and not form.facebook_link.data:
+    # optional, same as the create/edit pages
+    form.facebook_link.validators = []
+  if form.validate():
+    return form.data, None
+  return None, '; '.join(f'{f}: {", ".join(e)}' for f, e in form.errors.items())
+
+
+# BooleanField takes anything but 'false' and empty as true; spreadsheets
+# (and exports from before they wrote y) say False, no, 0...
+BOOLEANS = ('seeking_talent', 'seeking_venue')
+
+
+def _formdata(row):
+  data = MultiDict()
+  for key, value in row.items():
+    if key == 'website':
+      key = 'website_link'
+    if key == 'genres' and isinstance(value, str):
+      value = [g.strip() for g in value.replace(';', ',').split(',') if g.strip()]
+    for v in value if isinstance(value, list) else [value]:
+      if v is None:
+        continue
+      if key in BOOLEANS and isinstance(v, str):
+        v = v.strip().lower() not in FALSE
+      if isinstance(v, bool):
+        v = 'y' if v else ''
+      data.add(key, str(v))
+  return data
+
+
+def _entity(data):
+  d = dict(data)
+  d['genres'] = catalog.genres(d['genres'])
+  d['website'] = d.pop('website_link')
+  return d
+
+
+def _keep_all(records, report):
+  return records
+
+
+def _save_venues(sess, records):
+  sess.add_all([Venue(**_entity(d)) for _, d in records])
+
+
+def _save_artists(sess, records):
+  sess.add_all([Artist(**_entity(d)) for _, d in records])
+
+
+def _check_shows(records, report):
+  # resolve every artist/venue id in the chunk with one query per table
+  valid = []
+  for n, d in records:
+    d['end_time'] = scheduling.end_time(d['start_time'], d['end_time'])
+    problem = scheduling.check_times(d['start_time'], d['end_time'])
+    if problem:
+      report.error(n, problem)
+    else:
+      valid.append((n, d))
+  artists = _existing(Artist, {d['artist_id'] for _, d in valid})
+  venues = _existing(Venue, {d['venue_id'] for _, d in valid})
+  checked = []
+  for n, d in valid:
+    if d['artist_id'] not in artists:
+      report.error(n, f'no such artist (id: {d["artist_id"]})')
+    elif d['venue_id'] not in venues:
+      report.error(n, f'no such venue (id: {d["venue_id"]})')
+    else:
+      checked.append((n, d))
+  return scheduling.check_chunk(checked, report)
+
+
+def _existing(model, ids):
+  if not ids:
+    return set()
+  return {id for id, in db.session.query(model.id).filter(model.id.in_(ids))}
+
+
+def _save_shows(sess, records):
+  # shows are plain rows, one executemany for the whole chunk
+  rows = [d for _, d in records]
+  sess.execute(Show.__table__.insert(), rows)
+  note_changes(sess, {(Show, None)}
+    | {(Venue, d['venue_id']) for d in rows}
+    | {(Artist, d['artist_id']) for d in rows})
+
+
+Kind = namedtuple('Kind', 'form check save')
+
+KINDS = {
+  'venues': Kind(VenueForm, _keep_all, _save_venues),
+  'artists': Kind(ArtistForm, _keep_all, _save_artists),
+  'shows': Kind(ShowForm, _check_shows, _save_shows),
+}
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(list(KINDS)))
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'format', type=click.Choice(FORMATS),
+              help='defaults to the file extension')
+@click.option('--chunk-size', type=int, help='rows per transaction')
+@with_appcontext
+def import_command(kind, file, format, chunk_size):
+  """Bulk load venues, artists or shows from a CSV or JSONL file."""
+  format = format or guess_format(file.name)
+  if format is None:
+    raise click.UsageError('cannot tell the format from the file name, use --format')
+  report = import_rows(kind, read(file, format), chunk_size)
+  for n, message in sorted(report.errors):
+    click.echo(f'row {n}: {message}', err=True)
+  click.echo(f'{report.imported} {kind} imported, {len(report.errors)} rows rejected')
+
+
+EXPORTS = {
+  'venues': (Venue, venue_genres.c.venue_id, [
+    'id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'website',
+    'facebook_link', 'seeking_talent', 'seeking_description', 'image_link',
+  ]),
+  'artists': (Artist, artist_genres.c.artist_id, [
+    'id', 'name', 'city', 'state', 'phone', 'genres', 'website',
+    'facebook_link', 'seeking_venue', 'seeking_description', 'image_link',
+  ]),
+  'shows': (Show, None, ['id', 'artist_id', 'venue_id', 'start_time', 'end_time']),
+}
+
+
+# what ShowForm.start_time parses, so exported shows import as they are
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def export(kind, format, batch_size=None):
+  # yields the file in pieces, one per batch of rows
+  batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+  buffer = io.StringIO()
+  if format == 'csv':
+    writer = csv.DictWriter(buffer, EXPORTS[kind][2])
+    writer.writeheader()
+    write = writer.writerow
+  elif format == 'jsonl':
+    write = lambda row: buffer.write(json.dumps(row) + '\n')
+  else:
+    raise ValueError(f'unknown format {format!r}')
+  for batch in _export_batches(kind, batch_size):
+    for row in batch:
+      if format == 'csv':
+        _csv_row(row)
+      write(row)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue()
+
+
+def _csv_row(row):
+  # the way the importer reads them back
+  for k, v in row.items():
+    if isinstance(v, bool):
+      row[k] = 'y' if v else ''
+    elif isinstance(v, list):
+      row[k] = ';'.join(v)
+
+
+def _export_batches(kind, batch_size):
+  model, genre_fk, fields = EXPORTS[kind]
+  columns = [getattr(model, f) for f in fields if f != 'genres']
+  # plain column tuples, no identity map to fill up on the way
+  rows = iter(db.session.query(*columns).order_by(model.id).yield_per(batch_size))
+  while True:
+    batch = [_export_row(row) for row in islice(rows, batch_size)]
+    if not batch:
+      return
+    if genre_fk is not None:
+      genres = {}
+      for owner, name in db.session.query(genre_fk, Genre.name) \
+          .join(Genre, Genre.id == genre_fk.table.c.genre_id) \
+          .filter(genre_fk.in_([r['id'] for r in batch])):
+        genres.setdefault(owner, []).append(name)
+      for r in batch:
+        r['genres'] = genres.get(r['id'], [])
+    yield batch
+
+
+def _export_row(row):
+  return {
+    k: v.strftime(DATETIME_FORMAT) if isinstance(v, datetime) else v
+    for k, v in row._asdict().items()
+  }
+
+
+@click.command('export')
+@click.argument('kind', type=click.Choice(list(EXPORTS)))
+@click.option('--format', 'format', type=click.Choice(FORMATS), default='csv')
+@click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='defaults to stdout')
+@with_appcontext
+def export_command(kind, format, output):
+  """Dump venues, artists or shows as CSV or JSONL."""
+  for piece in export(kind, format):
+    output.write(piece)
+
+
+def init(app):
+  app.cli.add_command(import_command)
+  app.cli.add_command(export_command)
@@ -0,0 +1,321 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from threading import Lock
+from flask import current_app, g, make_response, request, session
+from werkzeug.http import is_resource_modified
+from sqlalchemy import event
+from models import db, after_commit, Artist, Show, Venue
+from jobs import task
+
+
+# whole-page cache for the read-mostly views. entries are never deleted on
+# writes; every key embeds the current version of the namespaces the page
+# depends on ('venues', 'venue:3', ...) and a write just bumps those
+# versions, which works the same against a dict or a shared redis.
+
+
+class MemoryBackend:
+  def __init__(self, size):
+    self.size = size
+    self.entries = OrderedDict()
+    # kept out of the lru: an evicted counter would restart at 0 and bring
+    # old pages back into reach
+    self.versions = {}
+    self.lock = Lock()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      value, expires = entry
+      if expires is not None and expires < time.monotonic():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl=None):
+    with self.lock:
+      expires = None if ttl is None else time.monotonic() + ttl
+      self.entries[key] = value, expires
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+
+  def version(self, namespace):
+    return self.versions.get(namespace, 0)
+
+  def bump(self, namespace):
+    with self.lock:
+      self.versions[namespace] = self.versions.get(namespace, 0) + 1
+
+
+class RedisBackend:
+  def __init__(self, url):
+    import redis
+    self.redis_module = redis
+    self.redis = redis.Redis.from_url(url)
+
+  # a page is a hash of its body and mimetype, plain bytes both ways. never
+  # pickle, anyone who can write to the redis could run code in here then
+
+  def get(self, key):
+    try:
+      body, mimetype = self.redis.hmget(key, 'body', 'mimetype')
+    except self.redis_module.ResponseError:
+      # not a hash, left over from an older release. set() replaces it
+      return None
+    if body is None or mimetype is None:
+      return None
+    return body, mimetype.decode('utf-8')
+
+  def set(self, key, value, ttl=None):
+    body, mimetype = value
+    with self.redis.pipeline() as pipe:
+      pipe.delete(key)
+      pipe.hset(key, mapping={'body': body, 'mimetype': mimetype})
+      if ttl:
+        pipe.expire(key, ttl)
+      pipe.execute()
+
+  def version(self, namespace):
+    return int(self.redis.get(f'version:{namespace}') or 0)
+
+  def bump(self, namespace):
+    self.redis.incr(f'version:{namespace}')
+
+
+class PageCache:
+  def __init__(self, backend, ttl):
+    self.backend = backend
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+  def key(self, path, namespaces, release='', etag=''):
+    # release: the code and asset build the page comes from, see release().
+    # workers on different ones share a redis while a deploy rolls out, and
+    # mustn't hand each other pages pointing at the wrong hashed files, say.
+    # etag: the validator
+    # @conditional is about to send with the page, so a body cached before a
+    # write can't go out under the etag from after it
+    versions = ','.join(f'{ns}@{self.backend.version(ns)}' for ns in namespaces)
+    return f'page:{release}:{etag}:{versions}:{path}'
+
+  def get(self, key):
+    value = self.backend.get(key)
+    if value is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return value
+
+  def set(self, key, value):
+    self.backend.set(key, value, self.ttl)
+
+  def invalidate(self, *namespaces):
+    for ns in namespaces:
+      self.backend.bump(ns)
+    self.invalidations += 1
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'invalidations': self.invalidations,
+    }
+
+
+def _revision(app):
+  # what all the workers of a deploy have in common when RELEASE doesn't
+  # name it: the code they run. a hash of the modules and templates, and
+  # when the newest of them changed
+  paths = [
+    os.path.join(app.root_path, name) for name in os.listdir(app.root_path) if name.endswith('.py')
+  ]
+  for root, dirs, names in os.walk(os.path.join(app.root_path, app.template_folder)):
+    paths += [os.path.join(root, name) for name in names]
+  digest = hashlib.sha256()
+  latest = 0
+  for path in sorted(paths):
+    digest.update(os.path.relpath(path, app.root_path).encode('utf-8') + b'\0')
+    with open(path, 'rb') as f:
+      digest.update(f.read())
+    latest = max(latest, os.path.getmtime(path))
+  return digest.hexdigest()[:12], datetime.fromtimestamp(int(latest), timezone.utc)
+
+
+def release():
+  # names what a page comes from: the deploy, and the asset build it links to
+  _, release = current_app.extensions['release']
+  manifest = current_app.extensions.get('assets')
+  return f'{release}.{manifest["hash"]}' if manifest else release
+
+
+def init(app):
+  # pages also change when the code does. RELEASE names the deploy, by
+  # default a hash of the code. a per-process name would leave every worker
+  # with validators and page keys of its own
+  revision, changed = _revision(app)
+  app.extensions['release'] = changed, app.config.get('RELEASE') or revision
+  kind = app.config.get('CACHE_BACKEND')
+  if kind == 'memory':
+    backend = MemoryBackend(app.config['CACHE_SIZE'])
+  elif kind == 'redis':
+    backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+  elif kind is None:
+    return
+  else:
+    raise ValueError(f'unknown CACHE_BACKEND {kind!r}')
+  app.extensions['page_cache'] = PageCache(backend, app.config['CACHE_TTL'])
+
+
+def cached(*namespaces):
+  # namespaces can refer to the view args, e.g. 'venue:{venue_id}'
+  def decorate(view):
+    @wraps(view)
+    def wrapper(**kwargs):
+      cache = current_app.extensions.get('page_cache')
+      # pages carrying flashed messages are one-offs, keep them out
+      if cache is None or request.method != 'GET' or session.get('_flashes'):
+        return view(**kwargs)
+      key = cache.key(
+        request.full_path,
+        [ns.format(**kwargs) for ns in namespaces],
+        release(),
+        g.get('etag', ''),
+      )
+      hit = cache.get(key)
+      if hit is not None:
+        body, mimetype = hit
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+      response = make_response(view(**kwargs))
+      if response.status_code == 200 and not response.direct_passthrough:
+        cache.set(key, (response.get_data(), response.mimetype))
+      response.headers['X-Cache'] = 'MISS'
+      return response
+    return wrapper
+  return decorate
+
+
+# what of a venue or artist the pages of the other side show, see
+# serializers.venue_show/artist_show
+SHOWN_ACROSS = ('name', 'image_link')
+
+
+def _track_renames(sess, flush_context):
+  # only edits to these make the other side's pages stale; the counters and
+  # anything else a commit touches show on the row's own pages alone
+  renamed = sess.info.setdefault('renamed', set())
+  for obj in sess.dirty:
+    if isinstance(obj, (Venue, Artist)):
+      state = db.inspect(obj)
+      if any(state.attrs[a].history.has_changes() for a in SHOWN_ACROSS):
+        renamed.add((type(obj), obj.id))
+
+
+def _forget_renames(sess, previous_transaction):
+  sess.info.pop('renamed', None)
+
+
+@after_commit
+def _invalidate(changes):
+  cache = current_app.extensions.get('page_cache')
+  renamed = db.session.info.pop('renamed', set())
+  if cache is None:
+    return
+  namespaces = set()
+  for model, id in changes:
+    if model is Venue:
+      namespaces |= {'venues', 'shows', f'venue:{id}'}
+    elif model is Artist:
+      namespaces |= {'artists', 'shows', f'artist:{id}'}
+    elif model is Show:
+      namespaces.add('shows')
+  # a show written changes both its venue and its artist already. what's
+  # left is the other side's pages listing a renamed venue or artist
+  for model, fk, other_fk, kind in (
+      (Venue, Show.venue_id, Show.artist_id, 'artist'),
+      (Artist, Show.artist_id, Show.venue_id, 'venue')):
+    ids = [id for m, id in renamed if m is model]
+    if ids:
+      namespaces.update(
+        f'{kind}:{id}' for id, in db.session.query(other_fk).filter(fk.in_(ids)).distinct()
+      )
+  if not namespaces:
+    return
+  cache.invalidate(*namespaces)
+  if current_app.config['CACHE_WARM']:
+    warm.delay(paths=_warm_paths(namespaces))
+
+
+# the pages a namespace stands for, where it's one page
+WARM = {'venues': '/venues', 'artists': '/artists', 'shows': '/shows'}
+
+
+def _warm_paths(namespaces):
+  paths = {WARM[ns] for ns in namespaces if ns in WARM}
+  for ns in namespaces:
+    kind, _, id = ns.partition(':')
+    if id.isdigit():
+      paths.add(f'/{kind}s/{id}')
+  return sorted(paths)
+
+
+@task('cache.warm', attempts=1)
+def warm(paths):
+  # renders the pages a write just invalidated, so the next visitor isn't
+  # the one waiting. only worth it with a cache the worker shares with the
+  # web processes, i.e. redis
+  client = current_app.test_client()
+  for path in paths:
+    # a fresh context each, requests don't expect to share g or a session
+    with current_app.app_context():
+      client.get(path)
+
+
+def conditional(last_modified):
+  # ETag/Last-Modified for a page from last_modified(**view_args), a naive
+  # local datetime or None (no validators, e.g. it's about to 404). a client
+  # that has the current version gets a 304 before the view, or the page
+  # cache, runs at all. goes above @cached
+  def decorate(view):
+    @wraps(view)
+    def wrapper(**kwargs):
+      if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return view(**kwargs)
+      changed = last_modified(**kwargs)
+      if changed is None:
+        return view(**kwargs)
+      released, _ = current_app.extensions['release']
+      changed = changed.astimezone(timezone.utc)
+      etag = f'{changed.timestamp() * 1e6:.0f}-{release()}'
+      # a page is no older than the code that rendered it either
+      changed = max(changed.replace(microsecond=0), released)
+      # for @cached, the body has to be the one this etag stands for
+      g.etag = etag
+      if is_resource_modified(request.environ, etag=etag, last_modified=changed):
+        response = make_response(view(**kwargs))
+        if response.status_code != 200:
+          return response
+      else:
+        response = current_app.response_class(status=304)
+      response.set_etag(etag, weak=True)
+      response.last_modified = changed
+      # keep checking back rather than guessing a max-age
+      response.headers['Cache-Control'] = 'no-cache'
+      return response
+    return wrapper
+  return decorate
+
+
+event.listen(db.session, 'after_flush', _track_renames)
+event.listen(db.session, 'after_soft_rollback', _forget_renames)
@@ -0,0 +1,78 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from models import db, Genre
+
+
+# the genre table is a fixed list seeded by a migration, so each process
+# loads it once and keeps the rows around detached. it gets dropped whenever
+# a Genre is written through the orm, or by an explicit reload(). an empty
+# table isn't kept, so a process that started before the seed migration ran
+# picks the genres up as soon as they're there. other changes made outside
+# the orm need a reload or a worker restart.
+
+_genres = None
+
+
+def reload():
+  global _genres
+  _genres = None
+  return _catalog()
+
+
+def _catalog():
+  global _genres
+  if _genres is None:
+    loaded = {}
+    for id, name in db.session.query(Genre.id, Genre.name):
+      # built by hand instead of queried so they never belong to a session
+      loaded[name] = g = Genre(id=id, name=name)
+      make_transient_to_detached(g)
+    if not loaded:
+      return loaded
+    _genres = loaded
+  return _genres
+
+
+def genre_choices():
+  # alphabetical, but 'Other' goes last
+  names = sorted(_catalog(), key=lambda n: (n == 'Other', n))
+  return [(n, n) for n in names]
+
+
+def genres(names):
+  # load=False attaches copies of the cached rows to the current session
+  # without asking the db whether they exist
+  known = _catalog()
+  return [db.session.merge(known[n], load=False) for n in names if n in known]
+
+
+@event.listens_for(Genre, 'after_insert')
+@event.listens_for(Genre, 'after_update')
+@event.listens_for(Genre, 'after_delete')
+def _invalidate(mapper, connection, target):
+  global _genres
+  _genres = None
+
+
+@click.group('genres')
+def genres_command():
+  """The genre catalog."""
+
+
+@genres_command.command('reload')
+@with_appcontext
+def reload_command():
+  """Load the catalog from the Genre table and list what's in it.
+
+  Servers already running reload on restart; use this to check what they
+  will see, e.g. after a migration.
+  """
+  reload()
+  names = [n for n, _ in genre_choices()]
+  click.echo(f'{len(names)} genres: {", ".join(names)}')
+
+
+def init(app):
+  app.cli.add_command(genres_command)
@@ -0,0 +1,106 @@
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from models import db, note_changes, transaction, Artist, Show, Venue
+from jobs import task
+
+
+# upcoming_show_count, past_show_count and next_show_at on Venue and Artist,
+# so listings and search read three columns instead of counting shows. a
+# commit that touches a show recounts its venue and artist (old ones too if
+# it moved) before it goes through. time moves shows from upcoming to past
+# without any write; the counters.rollover job recounts the rows whose
+# next_show_at has come, every ROLLOVER_EVERY seconds under `flask worker`.
+
+CHUNK = 500
+ROLLOVER_EVERY = 60
+
+SIDES = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+
+def _recount(model, fk):
+  # correlated to the row being updated, each one an index range on
+  # (fk, start_time)
+  upcoming = Show.is_upcoming()
+  return {
+    'upcoming_show_count': db.select(db.func.count(Show.id))
+      .where(fk == model.id).where(upcoming).scalar_subquery(),
+    'past_show_count': db.select(db.func.count(Show.id))
+      .where(fk == model.id).where(db.not_(upcoming)).scalar_subquery(),
+    'next_show_at': db.select(db.func.min(Show.start_time))
+      .where(fk == model.id).where(upcoming).scalar_subquery(),
+  }
+
+
+def refresh(sess, model, fk, ids):
+  ids = sorted(ids)
+  for start in range(0, len(ids), CHUNK):
+    sess.execute(
+      model.__table__.update()
+        .where(model.id.in_(ids[start:start + CHUNK]))
+        .values(**_recount(model, fk))
+    )
+
+
+def rebuild(sess):
+  for model, fk in SIDES:
+    sess.execute(model.__table__.update().values(**_recount(model, fk)))
+
+
+def due(sess, model):
+  # rows with a show that has started since they were counted
+  return {id for id, in sess.execute(
+    db.select(model.id).where(model.next_show_at < datetime.now())
+  )}
+
+
+def rollover(sess):
+  # reporting them as changed is enough, _maintain recounts them and the
+  # page cache, the area summary and updated_at catch up along with it
+  changed = {(model, id) for model, _ in SIDES for id in due(sess, model)}
+  note_changes(sess, changed)
+  return len(changed)
+
+
+@task('counters.rollover', every=ROLLOVER_EVERY)
+def rollover_job():
+  with transaction() as sess:
+    return rollover(sess)
+
+
+def _maintain(sess):
+  # flushing first so the changes include whatever is still pending
+  sess.flush()
+  changes = sess.info.get('changes', ())
+  for model, fk in SIDES:
+    ids = {id for m, id in changes if m is model and id is not None}
+    if ids:
+      refresh(sess, model, fk, ids)
+
+
+@click.group('counters')
+def counters_command():
+  """The show counts on Venue and Artist."""
+
+
+@counters_command.command('rollover')
+@click.option('--all', 'everything', is_flag=True, help='recount every row')
+@with_appcontext
+def rollover_command(everything):
+  """Move shows that have started from the upcoming to the past counts."""
+  if everything:
+    with transaction() as sess:
+      rebuild(sess)
+      note_changes(sess, {(Venue, None), (Artist, None)})
+      n = sum(sess.query(model).count() for model, _ in SIDES)
+  else:
+    n = rollover_job()
+  click.echo(f'{n} venues and artists recounted')
+
+
+def init(app):
+  app.cli.add_command(counters_command)
+
+
+event.listen(db.session, 'before_commit', _maintain)
@@ -4,15 +4,29 @@ from fabric.contrib.console import confirm
 # prepare for deployment
 
 
+BENCH_DB = "sqlite:////tmp/fyyur-bench.db"
+
+
 def test():
+    # runs tests/, then seeds a throwaway sqlite db and holds the pages to
+    # bench/budgets.json
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest -q"
+            " && rm -f /tmp/fyyur-bench.db"
+            " && python -m bench.seed --db {0} --create --cities 40"
+            " && python -m bench.scenarios --db {0} --check bench/budgets.json".format(BENCH_DB),
+            capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def assets():
+    # static/dist isn't checked in, build it where the app runs
+    local("flask assets build --strict")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -0,0 +1,104 @@
+from datetime import date, datetime, timedelta, timezone
+from flask import abort
+from models import Artist, Show, Venue
+
+
+# ?from=&to=&city=&state=&genre=&venue=&artist= on the show listings, the api
+# and the calendar export
+
+FILTERS = ('from', 'to', 'city', 'state', 'genre', 'venue', 'artist')
+
+
+def filters(args):
+  # request args -> Show.window keywords. `to` on its own date means the
+  # whole of that day
+  window = {}
+  if args.get('from'):
+    window['start'] = _when(args['from'])
+  if args.get('to'):
+    end = _when(args['to'])
+    window['end'] = end + timedelta(days=1) if len(args['to']) == 10 else end
+  for arg, key in (('city', 'city'), ('state', 'state'), ('genre', 'genre')):
+    if args.get(arg):
+      window[key] = args[arg].upper() if arg == 'state' else args[arg]
+  for arg, key in (('venue', 'venue_id'), ('artist', 'artist_id')):
+    if args.get(arg):
+      try:
+        window[key] = int(args[arg])
+      except ValueError:
+        abort(400, f'{arg} must be an id')
+  return window
+
+
+def _when(value):
+  try:
+    if len(value) == 10:
+      return datetime.combine(date.fromisoformat(value), datetime.min.time())
+    return datetime.fromisoformat(value)
+  except ValueError:
+    abort(400, f'{value!r} is not a date (YYYY-MM-DD or YYYY-MM-DDTHH:MM)')
+
+
+def ical(window, batch_size):
+  # yields the calendar a batch of shows at a time. start times are stored
+  # without a zone so they go out as floating (venue local) times
+  rows = Show.window(**window) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .with_entities(
+      Show.id, Show.start_time, Show.end_time, Artist.name, Venue.name,
+      Venue.address, Venue.city, Venue.state
+    ) \
+    .order_by(Show.start_time, Show.id) \
+    .yield_per(batch_size)
+  stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+  yield _lines([
+    'BEGIN:VCALENDAR',
+    'VERSION:2.0',
+    'PRODID:-//Fyyur//Shows//EN',
+    'CALSCALE:GREGORIAN',
+    'X-WR-CALNAME:Fyyur shows',
+  ])
+  batch = []
+  for id, start, end, artist, venue, address, city, state in rows:
+    batch += [
+      'BEGIN:VEVENT',
+      f'UID:show-{id}@fyyur',
+      f'DTSTAMP:{stamp}',
+      f'DTSTART:{start:%Y%m%dT%H%M%S}',
+      f'DTEND:{end:%Y%m%dT%H%M%S}',
+      f'SUMMARY:{_text(f"{artist} at {venue}")}',
+      f'LOCATION:{_text(", ".join(p for p in (venue, address, city, state) if p))}',
+      'END:VEVENT',
+    ]
+    if len(batch) >= batch_size * 8:
+      yield _lines(batch)
+      batch = []
+  batch.append('END:VCALENDAR')
+  yield _lines(batch)
+
+
+def _text(value):
+  return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+    .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _lines(lines):
+  return ''.join(_fold(line) + '\r\n' for line in lines)
+
+
+def _fold(line):
+  # content lines are limited to 75 octets, longer ones continue on the next
+  # line after a space
+  encoded = line.encode('utf-8')
+  if len(encoded) <= 75:
+    return line
+  parts, start = [], 0
+  while start < len(encoded):
+    end = min(start + (75 if not parts else 74), len(encoded))
+    # don't split a multibyte character
+    while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+      end -= 1
+    parts.append(encoded[start:end].decode('utf-8'))
+    start = end
+  return '\r\n '.join(parts)
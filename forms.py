@@ -1,22 +1,47 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, \
+    IntegerField
+from wtforms.validators import DataRequired, AnyOf, InputRequired, Optional, URL
+from catalog import genre_choices
+from models import db, Artist, Venue
 
 class ShowForm(Form):
-    artist_id = StringField(
-        'artist_id'
+    artist_id = IntegerField(
+        'artist_id', validators=[InputRequired()]
     )
-    venue_id = StringField(
-        'venue_id'
+    venue_id = IntegerField(
+        'venue_id', validators=[InputRequired()]
     )
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
         default= datetime.today()
     )
+    end_time = DateTimeField(
+        # two hours after the start if left out
+        'end_time',
+        validators=[Optional()]
+    )
+
+    def validate_references(self):
+        # after validate(): both ids in one round trip, before anything
+        # opens a write transaction
+        found = db.session.query(
+            db.exists().where(Artist.id == self.artist_id.data),
+            db.exists().where(Venue.id == self.venue_id.data),
+        ).one()
+        for field, kind, ok in zip((self.artist_id, self.venue_id), ('artist', 'venue'), found):
+            if not ok:
+                field.errors.append(f'No such {kind} (id: {field.data})')
+        return all(found)
 
-class VenueForm(Form):
+class _GenresFromCatalog:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.genres.choices = genre_choices()
+
+class VenueForm(_GenresFromCatalog, Form):
     name = StringField(
         'name', validators=[DataRequired()]
     )
@@ -89,29 +114,8 @@ class VenueForm(Form):
         'image_link'
     )
     genres = SelectMultipleField(
-        # TODO implement enum restriction
-        'genres', validators=[DataRequired()],
-        choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+        # choices come from the db, see _GenresFromCatalog
+        'genres', validators=[DataRequired()]
     )
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
@@ -128,7 +132,7 @@ class VenueForm(Form):
 
 
 
-class ArtistForm(Form):
+class ArtistForm(_GenresFromCatalog, Form):
     name = StringField(
         'name', validators=[DataRequired()]
     )
@@ -199,28 +203,8 @@ class ArtistForm(Form):
         'image_link'
     )
     genres = SelectMultipleField(
-        'genres', validators=[DataRequired()],
-        choices=[
-            ('Alternative', 'Alternative'),
-            ('Blues', 'Blues'),
-            ('Classical', 'Classical'),
-            ('Country', 'Country'),
-            ('Electronic', 'Electronic'),
-            ('Folk', 'Folk'),
-            ('Funk', 'Funk'),
-            ('Hip-Hop', 'Hip-Hop'),
-            ('Heavy Metal', 'Heavy Metal'),
-            ('Instrumental', 'Instrumental'),
-            ('Jazz', 'Jazz'),
-            ('Musical Theatre', 'Musical Theatre'),
-            ('Pop', 'Pop'),
-            ('Punk', 'Punk'),
-            ('R&B', 'R&B'),
-            ('Reggae', 'Reggae'),
-            ('Rock n Roll', 'Rock n Roll'),
-            ('Soul', 'Soul'),
-            ('Other', 'Other'),
-        ]
+        # choices come from the db, see _GenresFromCatalog
+        'genres', validators=[DataRequired()]
      )
     facebook_link = StringField(
         # TODO implement enum restriction
@@ -0,0 +1,245 @@
+import json
+import signal
+import threading
+import traceback
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, after_commit, job_queue, transaction
+
+
+# work that doesn't have to happen before the response: the counter
+# rollover, search reindexing, cache warming.
+# jobs are rows in the Job table, queued in the same transaction as the
+# write they follow (so they exist if and only if it committed), and run by
+# `flask worker`. a job that raises goes back in the queue with a growing
+# delay until it runs out of attempts; a worker that dies mid-job loses its
+# lease after JOBS_LEASE seconds and someone else picks it up.
+#
+# with JOBS_EAGER (testing) there is no worker; whatever a transaction
+# queued runs in the same thread as soon as it commits.
+
+TASKS = {}
+
+_eager = threading.local()
+
+
+class Task:
+  def __init__(self, fn, name, attempts, every):
+    self.fn = fn
+    self.name = name
+    self.attempts = attempts
+    self.every = every
+
+  def __call__(self, **kwargs):
+    return self.fn(**kwargs)
+
+  def delay(self, sess=None, **kwargs):
+    return enqueue(self.name, sess, **kwargs)
+
+
+def task(name, attempts=None, every=None):
+  # registers fn as a job. every=seconds also has `flask worker` queue it
+  # on that schedule
+  def decorate(fn):
+    t = TASKS[name] = Task(fn, name, attempts, every)
+    return t
+  return decorate
+
+
+def enqueue(name, sess=None, run_at=None, unique=False, **kwargs):
+  # in sess's transaction, or a transaction of its own without one. unique
+  # skips it if the same job is already waiting
+  if name not in TASKS:
+    raise LookupError(f'no task {name!r}')
+  if sess is None:
+    with transaction() as sess:
+      return enqueue(name, sess, run_at, unique, **kwargs)
+  args = json.dumps(kwargs, sort_keys=True)
+  q = job_queue.c
+  if unique and sess.execute(
+      db.select(q.id).where(q.task == name, q.args == args, q.state == 'queued').limit(1)
+  ).first():
+    return None
+  now = datetime.now()
+  attempts = TASKS[name].attempts or current_app.config['JOBS_MAX_ATTEMPTS']
+  id = sess.execute(job_queue.insert().values(
+    task=name, args=args, state='queued', attempts=0, max_attempts=attempts,
+    run_at=run_at or now, created_at=now,
+  )).inserted_primary_key[0]
+  sess.info['jobs_queued'] = True
+  return id
+
+
+def _claimable(now):
+  q = job_queue.c
+  return db.or_(
+    db.and_(q.state == 'queued', q.run_at <= now),
+    # a worker died holding it
+    db.and_(q.state == 'running', q.locked_until < now),
+  )
+
+
+def claim():
+  # the next due job, marked running under a lease. skip locked on postgres
+  # so workers don't queue up behind each other's picks; the conditional
+  # update is what makes it safe where that's ignored (sqlite)
+  q = job_queue.c
+  now = datetime.now()
+  lease = timedelta(seconds=current_app.config['JOBS_LEASE'])
+  with transaction() as sess:
+    row = sess.execute(
+      db.select(q.id, q.task, q.args, q.attempts, q.max_attempts)
+        .where(_claimable(now))
+        .order_by(q.run_at, q.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if row is None:
+      return None
+    claimed = sess.execute(
+      job_queue.update()
+        .where(q.id == row.id)
+        .where(_claimable(now))
+        .values(state='running', attempts=q.attempts + 1, locked_until=now + lease)
+    ).rowcount
+    return row if claimed else None
+
+
+def run(job):
+  q = job_queue.c
+  attempt = job.attempts + 1
+  try:
+    if job.task not in TASKS:
+      raise LookupError(f'no task {job.task!r}')
+    TASKS[job.task](**json.loads(job.args))
+  except Exception:
+    db.session.rollback()
+    current_app.logger.exception('job %s (%s) failed, attempt %s of %s',
+      job.id, job.task, attempt, job.max_attempts)
+    if attempt < job.max_attempts:
+      delay = current_app.config['JOBS_BACKOFF'] * 2 ** (attempt - 1)
+      values = {'state': 'queued', 'run_at': datetime.now() + timedelta(seconds=delay)}
+    else:
+      values = {'state': 'failed'}
+    values['error'] = traceback.format_exc()
+  else:
+    values = {'state': 'done', 'error': None}
+  with transaction() as sess:
+    sess.execute(job_queue.update().where(q.id == job.id).values(locked_until=None, **values))
+  return values['state']
+
+
+def work_off():
+  # runs what's due until there's nothing left, in this thread
+  done = 0
+  while True:
+    job = claim()
+    if job is None:
+      return done
+    run(job)
+    done += 1
+
+
+def work(app, threads, poll):
+  # `threads` loops claiming and running jobs, plus this one queueing the
+  # periodic tasks, until SIGTERM or ^C
+  stop = threading.Event()
+
+  def loop():
+    with app.app_context():
+      while not stop.is_set():
+        try:
+          if not work_off():
+            stop.wait(poll)
+        except Exception:
+          # the queue itself failing, e.g. the db going away. try again
+          app.logger.exception('worker loop failed')
+          stop.wait(poll)
+
+  workers = [threading.Thread(target=loop, name=f'worker-{n}') for n in range(threads)]
+  for w in workers:
+    w.start()
+  signal.signal(signal.SIGTERM, lambda *_: stop.set())
+  last = {}
+  with app.app_context():
+    try:
+      while not stop.is_set():
+        now = datetime.now()
+        for t in TASKS.values():
+          if t.every and now - last.get(t.name, datetime.min) >= timedelta(seconds=t.every):
+            enqueue(t.name, unique=True)
+            last[t.name] = now
+        stop.wait(poll)
+    except KeyboardInterrupt:
+      stop.set()
+  for w in workers:
+    w.join()
+
+
+@task('jobs.purge', every=3600)
+def purge(days=7):
+  # done jobs only, failed ones stay around to be looked at
+  q = job_queue.c
+  with transaction() as sess:
+    return sess.execute(job_queue.delete().where(
+      q.state == 'done', q.run_at < datetime.now() - timedelta(days=days)
+    )).rowcount
+
+
+@after_commit
+def _eager_run(changes):
+  sess = db.session
+  if not sess.info.pop('jobs_queued', False) or not current_app.config['JOBS_EAGER']:
+    return
+  # jobs queueing jobs get picked up by the loop that's already going
+  if getattr(_eager, 'running', False):
+    return
+  _eager.running = True
+  try:
+    work_off()
+  finally:
+    _eager.running = False
+
+
+@click.command('worker')
+@click.option('--threads', type=int, help='jobs run at once, JOBS_THREADS by default')
+@click.option('--poll', type=float, help='seconds between looks at an empty queue')
+@with_appcontext
+def worker_command(threads, poll):
+  """Run queued jobs until stopped."""
+  app = current_app._get_current_object()
+  threads = threads or app.config['JOBS_THREADS']
+  click.echo(f'working with {threads} threads on {", ".join(sorted(TASKS))}')
+  work(app, threads, poll or app.config['JOBS_POLL'])
+
+
+@click.group('jobs')
+def jobs_command():
+  """The background job queue."""
+
+
+@jobs_command.command('enqueue')
+@click.argument('name')
+@click.argument('args', default='{}')
+@with_appcontext
+def enqueue_command(name, args):
+  """Queue task NAME with ARGS, a json object of keyword arguments."""
+  if name not in TASKS:
+    raise click.BadParameter(f'one of {", ".join(sorted(TASKS))}', param_hint='NAME')
+  click.echo(f'job {enqueue(name, **json.loads(args))} queued')
+
+
+@jobs_command.command('status')
+@with_appcontext
+def status_command():
+  """Jobs per state."""
+  q = job_queue.c
+  for state, n in db.session.query(q.state, db.func.count()).group_by(q.state).order_by(q.state):
+    click.echo(f'{state:8} {n}')
+
+
+def init(app):
+  app.cli.add_command(worker_command)
+  app.cli.add_command(jobs_command)
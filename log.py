@@ -0,0 +1,93 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+
+# the request thread only formats the record and drops it on a queue. a
+# listener thread does the writing (and the rotating), so a slow disk never
+# holds up a response. records are one json object per line, tagged with the
+# request id so everything one request logged can be pulled out together.
+
+
+class RequestContext(logging.Filter):
+  def filter(self, record):
+    if has_request_context():
+      record.request_id = g.get('request_id')
+      record.method = request.method
+      record.path = request.path
+    else:
+      record.request_id = record.method = record.path = None
+    return True
+
+
+class JsonFormatter(logging.Formatter):
+  def format(self, record):
+    entry = {
+      'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+      'request_id': getattr(record, 'request_id', None),
+      'method': getattr(record, 'method', None),
+      'path': getattr(record, 'path', None),
+      'where': f'{record.pathname}:{record.lineno}',
+    }
+    if record.exc_info:
+      entry['exception'] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+
+def _target(app):
+  # '-' is stderr, for when the process manager collects the logs. several
+  # workers shouldn't rotate the same file, give each its own LOG_FILE then
+  path = app.config['LOG_FILE']
+  if path == '-':
+    return logging.StreamHandler(sys.stderr)
+  return RotatingFileHandler(
+    path,
+    maxBytes=app.config['LOG_MAX_BYTES'],
+    backupCount=app.config['LOG_BACKUPS'],
+    encoding='utf-8',
+  )
+
+
+def _tag_request():
+  g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+
+def _echo_request_id(response):
+  if 'request_id' in g:
+    response.headers['X-Request-ID'] = g.request_id
+  return response
+
+
+def init(app):
+  app.before_request(_tag_request)
+  app.after_request(_echo_request_id)
+  if app.debug or app.testing:
+    # flask's own stderr handler is fine for those
+    return
+  records = queue.SimpleQueue()
+  handler = QueueHandler(records)
+  # formatting happens here, on the request thread, while the request is
+  # still around to tag the record with
+  handler.addFilter(RequestContext())
+  handler.setFormatter(JsonFormatter())
+  target = _target(app)
+  target.setFormatter(logging.Formatter('%(message)s'))
+  listener = QueueListener(records, target)
+  # threads don't survive a fork, so this wants to run in each worker (no
+  # gunicorn --preload)
+  listener.start()
+  atexit.register(listener.stop)
+  app.logger.setLevel(app.config['LOG_LEVEL'])
+  app.logger.removeHandler(default_handler)
+  app.logger.addHandler(handler)
+  app.extensions['log_listener'] = listener
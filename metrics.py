@@ -0,0 +1,188 @@
+import time
+from collections import Counter
+from threading import Lock
+from flask import Blueprint, current_app, g, has_request_context, request, \
+  template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import pool
+
+
+# per request wall time, sql statements and time, template time. each
+# response carries them in a Server-Timing header (devtools shows it under
+# Timing) and the totals go out at /metrics in the prometheus text format.
+# the numbers are per process, prometheus sums the workers up.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Sample:
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.queries = 0
+    self.db_time = 0.0
+    self.template_time = 0.0
+    self.template_start = None
+
+
+class Registry:
+  def __init__(self):
+    self.lock = Lock()
+    self.requests = Counter()
+    self.buckets = {}
+    self.seconds = Counter()
+    self.queries = Counter()
+    self.db_seconds = Counter()
+    self.template_seconds = Counter()
+    self.over_budget = Counter()
+
+  def observe(self, endpoint, method, status, sample, elapsed, over_budget):
+    with self.lock:
+      self.requests[endpoint, method, status] += 1
+      counts = self.buckets.setdefault(endpoint, [0] * len(BUCKETS))
+      for i, le in enumerate(BUCKETS):
+        if elapsed <= le:
+          counts[i] += 1
+      self.seconds[endpoint] += elapsed
+      self.queries[endpoint] += sample.queries
+      self.db_seconds[endpoint] += sample.db_time
+      self.template_seconds[endpoint] += sample.template_time
+      if over_budget:
+        self.over_budget[endpoint] += 1
+
+  def render(self):
+    out = []
+    with self.lock:
+      _family(out, 'fyyur_requests_total', 'counter', 'Requests handled.')
+      for (endpoint, method, status), n in sorted(self.requests.items()):
+        out.append(f'fyyur_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {n}')
+      _family(out, 'fyyur_request_duration_seconds', 'histogram', 'Wall time per request.')
+      for endpoint, counts in sorted(self.buckets.items()):
+        total = sum(n for (e, _, _), n in self.requests.items() if e == endpoint)
+        for le, n in zip(BUCKETS, counts):
+          out.append(f'fyyur_request_duration_seconds_bucket{_labels(endpoint=endpoint, le=le)} {n}')
+        out.append(f'fyyur_request_duration_seconds_bucket{_labels(endpoint=endpoint, le="+Inf")} {total}')
+        out.append(f'fyyur_request_duration_seconds_sum{_labels(endpoint=endpoint)} {self.seconds[endpoint]:.6f}')
+        out.append(f'fyyur_request_duration_seconds_count{_labels(endpoint=endpoint)} {total}')
+      for name, help, counter in (
+        ('fyyur_db_queries_total', 'SQL statements executed.', self.queries),
+        ('fyyur_db_seconds_total', 'Time spent in SQL statements.', self.db_seconds),
+        ('fyyur_template_seconds_total', 'Time spent rendering templates.', self.template_seconds),
+        ('fyyur_query_budget_exceeded_total', 'Requests over QUERY_BUDGET.', self.over_budget),
+      ):
+        _family(out, name, 'counter', help)
+        for endpoint, n in sorted(counter.items()):
+          out.append(f'{name}{_labels(endpoint=endpoint)} {n:g}')
+    return out
+
+
+def _family(out, name, kind, help):
+  out.append(f'# HELP {name} {help}')
+  out.append(f'# TYPE {name} {kind}')
+
+
+def _labels(**labels):
+  def escape(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+  return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _sample():
+  return g.get('metrics_sample') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  start = conn.info['metrics_query_start'].pop()
+  sample = _sample()
+  if sample is not None:
+    sample.queries += 1
+    sample.db_time += time.perf_counter() - start
+
+
+def _handle_error(context):
+  # after_cursor_execute doesn't run for a statement that failed
+  starts = context.connection.info.get('metrics_query_start') if context.connection else None
+  if starts:
+    starts.pop()
+
+
+def _before_render(app, template, context, **extra):
+  sample = _sample()
+  if sample is not None:
+    sample.template_start = time.perf_counter()
+
+
+def _rendered(app, template, context, **extra):
+  sample = _sample()
+  if sample is not None and sample.template_start is not None:
+    sample.template_time += time.perf_counter() - sample.template_start
+    sample.template_start = None
+
+
+def _start():
+  g.metrics_sample = Sample()
+
+
+def _finish(response):
+  sample = g.pop('metrics_sample', None)
+  if sample is None:
+    return response
+  elapsed = time.perf_counter() - sample.start
+  endpoint = request.endpoint or 'unmatched'
+  budget = current_app.config['QUERY_BUDGET']
+  over_budget = budget is not None and sample.queries > budget
+  if over_budget:
+    # most likely a relationship loaded per row, look for a missing joinedload
+    current_app.logger.warning(
+      '%s %s ran %d queries, over the budget of %d',
+      request.method, request.full_path.rstrip('?'), sample.queries, budget
+    )
+  current_app.extensions['metrics'].observe(
+    endpoint, request.method, response.status_code, sample, elapsed, over_budget
+  )
+  if current_app.config['SERVER_TIMING']:
+    response.headers.add('Server-Timing', ', '.join([
+      f'app;dur={elapsed * 1000:.1f}',
+      f'db;dur={sample.db_time * 1000:.1f};desc="{sample.queries} queries"',
+      f'tpl;dur={sample.template_time * 1000:.1f}',
+    ]))
+  return response
+
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def scrape():
+  out = current_app.extensions['metrics'].render()
+  cache = current_app.extensions.get('page_cache')
+  if cache is not None:
+    for key, n in sorted(cache.stats().items()):
+      _family(out, f'fyyur_page_cache_{key}_total', 'counter', f'Page cache {key}.')
+      out.append(f'fyyur_page_cache_{key}_total {n}')
+  for key, n in sorted(pool.stats().items()):
+    if key != 'class':
+      _family(out, f'fyyur_db_pool_{key}', 'gauge', f'Connection pool {key}.')
+      out.append(f'fyyur_db_pool_{key} {n}')
+  return current_app.response_class(
+    '\n'.join(out) + '\n',
+    mimetype='text/plain; version=0.0.4'
+  )
+
+
+def init(app):
+  app.extensions['metrics'] = Registry()
+  app.before_request(_start)
+  app.after_request(_finish)
+  before_render_template.connect(_before_render, app)
+  template_rendered.connect(_rendered, app)
+  app.register_blueprint(bp)
+
+
+event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+event.listen(Engine, 'handle_error', _handle_error)
@@ -25,6 +25,18 @@ config.set_main_option(
     str(current_app.extensions['migrate'].db.engine.url).replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # the search index is per dialect and made by hand, see search.py: the
+    # fts5 tables (and their shadow tables) on sqlite, a trigram index on
+    # postgres. autogenerate would only ever propose dropping them
+    if type_ == 'table' and 'Search' in name:
+        return False
+    if type_ == 'index' and name and name.endswith('_search_text_trgm'):
+        return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -45,7 +57,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -73,10 +86,15 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.engine
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # batch migrations copy and drop tables, which with foreign
+            # keys on would cascade into the rows pointing at them
+            connection.exec_driver_sql('pragma foreign_keys = off')
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,31 @@
+"""added lower(name) prefix indexes on Venue and Artist
+
+Revision ID: 4a0c8e6f1b27
+Revises: d2f6b9a1c734
+Create Date: 2021-06-26 10:37:52.118064
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a0c8e6f1b27'
+down_revision = 'd2f6b9a1c734'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.create_index(
+            f'ix_{table}_name_lower', table,
+            [sa.text('lower(name) text_pattern_ops' if op.get_bind().dialect.name == 'postgresql'
+                     else 'lower(name)')],
+            unique=False
+        )
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_index(f'ix_{table}_name_lower', table_name=table)
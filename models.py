@@ -1,7 +1,10 @@
 from contextlib import contextmanager
 from datetime import datetime
+from itertools import chain
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
 
 
 db = SQLAlchemy()
@@ -11,9 +14,20 @@ def init(app):
     return Migrate(app, db)
 
 
+_commit_hooks = []
+
+def after_commit(hook):
+  # hook(changes) runs after every transaction() commits. changes is a set of
+  # (model class, id) for every Venue, Artist and Show written in it, maybe
+  # none; a Show also counts as a change to its venue and artist.
+  _commit_hooks.append(hook)
+  return hook
+
+
 @contextmanager
 def transaction():
   sess = db.session
+  sess.info.pop('changes', None)
   try:
     yield sess
     sess.commit()
@@ -21,19 +35,61 @@ def transaction():
     sess.rollback()
     raise
   finally:
+    changes = sess.info.pop('changes', None)
     sess.close()
+  for hook in _commit_hooks:
+    hook(changes or set())
+
+
+def note_changes(sess, changes):
+  # for writes that skip the unit of work (bulk core inserts), so the
+  # after_commit hooks still hear about them
+  sess.info.setdefault('changes', set()).update(changes)
+
+
+def _track_changes(sess, flush_context):
+  changes = sess.info.setdefault('changes', set())
+  for obj in chain(sess.new, sess.dirty, sess.deleted):
+    if isinstance(obj, (Venue, Artist, Show)):
+      changes.add((type(obj), obj.id))
+    if isinstance(obj, Show):
+      state = db.inspect(obj)
+      for model, attr in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+        # the old one too if the show moved
+        history = state.attrs[attr].history
+        for id in chain([getattr(obj, attr)], history.deleted):
+          if id is not None:
+            changes.add((model, id))
+
+
+def _track_cascades(sess, flush_context, instances):
+  # the shows of a deleted venue or artist go with it in the db, without
+  # the orm ever loading them. whoever was on the other side of them still
+  # changes, so they're noted before the rows are gone
+  changes = sess.info.setdefault('changes', set())
+  for model, fk, other, other_fk in (
+      (Venue, Show.venue_id, Artist, Show.artist_id),
+      (Artist, Show.artist_id, Venue, Show.venue_id)):
+    ids = [obj.id for obj in sess.deleted if isinstance(obj, model)]
+    if ids:
+      with sess.no_autoflush:
+        rows = sess.query(other_fk).filter(fk.in_(ids)).distinct()
+        changes.update((other, id) for id, in rows if id is not None)
 
 
 venue_genres = db.Table(
   'VenueGenre',
   db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
   db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True),
+  # the pk leads with genre_id, this one serves lookups from the venue side
+  db.Index('ix_VenueGenre_venue_id_genre_id', 'venue_id', 'genre_id'),
 )
 
 artist_genres = db.Table(
   'ArtistGenre',
   db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
   db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True),
+  db.Index('ix_ArtistGenre_artist_id_genre_id', 'artist_id', 'genre_id'),
 )
 
 
@@ -50,6 +106,12 @@ class Genre(db.Model):
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    # search_text is indexed per dialect, see search.py
+    __table_args__ = (
+      db.Index('ix_Venue_state_city_id', 'state', 'city', 'id'),
+      # Show.window by city alone
+      db.Index('ix_Venue_city_state_id', 'city', 'state', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -63,16 +125,34 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String)
+    # maintained by search.py
+    search_text = db.Column(db.String)
+    # maintained by _touch, see cache.conditional
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    # maintained by counters.py
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime, index=True)
     genres = db.relationship('Genre', secondary=venue_genres)
-    shows = db.relationship('Show', backref='venue')
+    # the db deletes the shows along with it (ON DELETE CASCADE)
+    shows = db.relationship(
+      'Show', backref='venue', cascade='all, delete-orphan', passive_deletes=True
+    )
 
-    @property
-    def upcoming_shows(self):
-      return Show.upcoming(self.shows)
+    @staticmethod
+    def detail(id):
+      return Venue.query.options(joinedload(Venue.genres)).get(id)
 
-    @property
-    def past_shows(self):
-      return Show.past(self.shows)
+    def timeline(self):
+      return Show.partition(
+        Show.query
+          .options(joinedload(Show.artist))
+          .filter(Show.venue_id == self.id)
+      )
+
+    @staticmethod
+    def last_modified(id):
+      return _last_modified(Venue, id, Show.venue_id, Artist, Show.artist_id)
 
     def __repr__(self):
         return f'<Venue {self.id}: {self.name}>'
@@ -80,6 +160,10 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    # search_text is indexed per dialect, see search.py
+    __table_args__ = (
+      db.Index('ix_Artist_name_id', 'name', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -92,16 +176,31 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String)
+    # maintained by search.py
+    search_text = db.Column(db.String)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime, index=True)
     genres = db.relationship('Genre', secondary=artist_genres)
-    shows = db.relationship('Show', backref='artist')
+    shows = db.relationship(
+      'Show', backref='artist', cascade='all, delete-orphan', passive_deletes=True
+    )
+
+    @staticmethod
+    def detail(id):
+      return Artist.query.options(joinedload(Artist.genres)).get(id)
 
-    @property
-    def upcoming_shows(self):
-      return Show.upcoming(self.shows)
+    def timeline(self):
+      return Show.partition(
+        Show.query
+          .options(joinedload(Show.venue))
+          .filter(Show.artist_id == self.id)
+      )
 
-    @property
-    def past_shows(self):
-      return Show.past(self.shows)
+    @staticmethod
+    def last_modified(id):
+      return _last_modified(Artist, id, Show.artist_id, Venue, Show.venue_id)
 
     def __repr__(self):
         return f'<Artist {self.id}: {self.name}>'
@@ -109,19 +208,196 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+      db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+      # Venue.shows/Artist.shows, the upcoming counts and the cascades all
+      # go through these
+      db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+      db.CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'))
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'))
     start_time = db.Column(db.DateTime, index=True)
+    # the show is on over [start_time, end_time), see scheduling.py
+    end_time = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    @staticmethod
+    def is_upcoming():
+      # shows starting from now on. the bind is resolved at execution time so
+      # cached statements don't freeze the clock
+      return Show.start_time >= db.bindparam('now', callable_=datetime.now, unique=True)
 
     @staticmethod
-    def upcoming(shows):
-      return [s for s in shows if s.start_time >= datetime.now()]
+    def partition(query):
+      # one round trip for both lists. the db flags each row as upcoming or
+      # not and sorts them, we just deal them into the right pile
+      past, upcoming = [], []
+      rows = query \
+        .add_columns(Show.is_upcoming().label('is_upcoming')) \
+        .order_by(Show.start_time, Show.id)
+      for show, is_upcoming in rows:
+        (upcoming if is_upcoming else past).append(show)
+      return past, upcoming
 
     @staticmethod
-    def past(shows):
-      return [s for s in shows if s.start_time < datetime.now()]
+    def window(start=None, end=None, city=None, state=None, genre=None,
+               venue_id=None, artist_id=None):
+      # shows starting in [start, end), narrowed down by where and who. the
+      # place and genre filters are id subqueries rather than joins, so the
+      # caller can still joinedload venue and artist without a second join
+      query = Show.query
+      if start is not None:
+        query = query.filter(Show.start_time >= start)
+      if end is not None:
+        query = query.filter(Show.start_time < end)
+      if venue_id is not None:
+        query = query.filter(Show.venue_id == venue_id)
+      if artist_id is not None:
+        query = query.filter(Show.artist_id == artist_id)
+      if city is not None or state is not None:
+        venues = db.select(Venue.id)
+        if city is not None:
+          venues = venues.where(Venue.city == city)
+        if state is not None:
+          venues = venues.where(Venue.state == state)
+        query = query.filter(Show.venue_id.in_(venues))
+      if genre is not None:
+        query = query.filter(Show.artist_id.in_(
+          db.select(artist_genres.c.artist_id)
+            .join(Genre, Genre.id == artist_genres.c.genre_id)
+            .where(Genre.name == genre)
+        ))
+      return query
 
     def __repr__(self):
         return f'<Show {self.id}: {self.artist}@{self.venue}>'
+
+
+def _last_modified(model, id, fk, other, other_fk):
+  # when the detail page of model `id` last changed: its own row (which
+  # _touch bumps for any change to its shows too), the other side of its
+  # shows, and the latest of its shows to have moved from upcoming to past.
+  # None if there's no such row
+  row = db.session.query(
+    model.updated_at,
+    db.select(db.func.max(other.updated_at))
+      .join(Show, other_fk == other.id)
+      .where(fk == model.id)
+      .scalar_subquery(),
+    db.select(db.func.max(Show.start_time))
+      .where(fk == model.id)
+      .where(db.not_(Show.is_upcoming()))
+      .scalar_subquery(),
+  ).filter(model.id == id).first()
+  if row is None:
+    return None
+  return max(t for t in row if t is not None)
+
+# name prefix lookups (search.prefix), text_pattern_ops so postgres can use
+# them for LIKE 'x%' whatever the collation
+db.Index(
+  'ix_Venue_name_lower', db.func.lower(Venue.name).label('name_lower'),
+  postgresql_ops={'name_lower': 'text_pattern_ops'}
+)
+db.Index(
+  'ix_Artist_name_lower', db.func.lower(Artist.name).label('name_lower'),
+  postgresql_ops={'name_lower': 'text_pattern_ops'}
+)
+
+
+# the /venues page reads only these two. they're kept in step with Venue and
+# Show inside the same commit, see areas.py
+area_venues = db.Table(
+  'AreaVenue',
+  db.Column('venue_id', db.Integer, primary_key=True),
+  db.Column('state', db.String(120), nullable=False),
+  db.Column('city', db.String(120), nullable=False),
+  db.Column('name', db.String, nullable=False),
+  # Venue.upcoming_show_count, as of the last commit touching the venue
+  db.Column('upcoming_shows', db.Integer, nullable=False),
+  db.Index('ix_AreaVenue_state_city_name', 'state', 'city', 'name'),
+)
+
+area_summary = db.Table(
+  'Area',
+  db.Column('state', db.String(120), primary_key=True),
+  db.Column('city', db.String(120), primary_key=True),
+  db.Column('venues', db.Integer, nullable=False),
+  db.Column('upcoming_shows', db.Integer, nullable=False),
+)
+
+
+# background jobs, see jobs.py
+job_queue = db.Table(
+  'Job',
+  db.Column('id', db.Integer, primary_key=True),
+  db.Column('task', db.String(80), nullable=False),
+  # keyword arguments, as json
+  db.Column('args', db.Text, nullable=False),
+  # queued, running, done or failed
+  db.Column('state', db.String(10), nullable=False),
+  db.Column('attempts', db.Integer, nullable=False),
+  db.Column('max_attempts', db.Integer, nullable=False),
+  db.Column('run_at', db.DateTime, nullable=False),
+  # a running job whose worker hasn't finished it by then is up for grabs
+  db.Column('locked_until', db.DateTime),
+  db.Column('error', db.Text),
+  db.Column('created_at', db.DateTime, nullable=False),
+  db.Index('ix_Job_state_run_at', 'state', 'run_at'),
+)
+
+
+# one row per model, when anything in its table last changed (deletes
+# included), for the listing pages' validators
+last_changes = db.Table(
+  'LastChange',
+  db.Column('model', db.String(20), primary_key=True),
+  db.Column('changed_at', db.DateTime, nullable=False),
+)
+
+TRACKED = (Venue, Artist, Show)
+
+
+def last_change(*models):
+  return db.session.query(db.func.max(last_changes.c.changed_at)) \
+    .filter(last_changes.c.model.in_([m.__tablename__ for m in models])) \
+    .scalar()
+
+
+def _touch(sess):
+  # stamps everything the transaction wrote (and the venue and artist of
+  # every show it wrote) with the commit time. core updates, so deleted rows
+  # just don't match
+  sess.flush()
+  changes = sess.info.get('changes', ())
+  if not changes:
+    return
+  now = datetime.now()
+  for model in TRACKED:
+    ids = {id for m, id in changes if m is model and id is not None}
+    if ids:
+      sess.execute(
+        model.__table__.update().where(model.id.in_(ids)).values(updated_at=now)
+      )
+  sess.execute(
+    last_changes.update()
+      .where(last_changes.c.model.in_({m.__tablename__ for m, _ in changes}))
+      .values(changed_at=now)
+  )
+
+
+@event.listens_for(last_changes, 'after_create')
+def _seed_last_changes(target, connection, **kw):
+  now = datetime.now()
+  connection.execute(target.insert(), [
+    {'model': m.__tablename__, 'changed_at': now} for m in TRACKED
+  ])
+
+
+event.listen(db.session, 'before_flush', _track_cascades)
+event.listen(db.session, 'after_flush', _track_changes)
+event.listen(db.session, 'before_commit', _touch)
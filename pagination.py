@@ -0,0 +1,71 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+from flask import abort, current_app, request, url_for
+from models import db
+
+
+Page = namedtuple('Page', 'items next_url prev_url')
+
+
+def keyset(query, *columns):
+  # seek pagination: the cursor is the sort key of the row at the edge of the
+  # current page, so every page is an index range scan of `size` rows no
+  # matter how deep into the listing we are. `columns` must end with
+  # something unique (the pk) so the order is total.
+  size = request.args.get('size', current_app.config['PAGE_SIZE'], type=int)
+  size = max(1, min(size, current_app.config['MAX_PAGE_SIZE']))
+  after = request.args.get('after')
+  before = request.args.get('before')
+  key = db.tuple_(*columns)
+
+  if before:
+    rows = query \
+      .filter(key < _decode(before, columns)) \
+      .order_by(*[c.desc() for c in columns]) \
+      .limit(size + 1) \
+      .all()
+    has_prev, has_next = len(rows) > size, True
+    rows = rows[:size][::-1]
+  else:
+    if after:
+      query = query.filter(key > _decode(after, columns))
+    rows = query.order_by(*columns).limit(size + 1).all()
+    has_prev, has_next = after is not None, len(rows) > size
+    rows = rows[:size]
+
+  next_url = prev_url = None
+  if rows and has_next:
+    next_url = _page_url(size, after=_encode(rows[-1], columns))
+  if rows and has_prev:
+    prev_url = _page_url(size, before=_encode(rows[0], columns))
+  return Page(rows, next_url, prev_url)
+
+
+def _page_url(size, **cursor):
+  args = request.args.to_dict()
+  args.pop('after', None)
+  args.pop('before', None)
+  args.update(cursor, size=size)
+  return url_for(request.endpoint, **request.view_args, **args)
+
+
+def _encode(row, columns):
+  values = [getattr(row, c.key) for c in columns]
+  values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+  return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode(cursor, columns):
+  try:
+    values = json.loads(urlsafe_b64decode(cursor.encode()))
+    if len(values) != len(columns):
+      raise ValueError(cursor)
+    values = [
+      datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) else v
+      for v, c in zip(values, columns)
+    ]
+  except (ValueError, TypeError):
+    abort(400)
+  return db.tuple_(*[db.literal(v, c.type) for v, c in zip(values, columns)])
@@ -0,0 +1,131 @@
+import sqlite3
+import time
+from functools import wraps
+from flask import Blueprint, current_app, g, has_request_context, jsonify
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from models import db
+
+
+class TimedQueuePool(QueuePool):
+  # QueuePool that keeps track of how long checkouts wait for a connection
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.checkouts = 0
+    self.wait_total = 0.0
+    self.wait_max = 0.0
+    self.timeouts = 0
+
+  def _do_get(self):
+    start = time.perf_counter()
+    try:
+      return super()._do_get()
+    except Exception:
+      self.timeouts += 1
+      raise
+    finally:
+      waited = time.perf_counter() - start
+      self.checkouts += 1
+      self.wait_total += waited
+      self.wait_max = max(self.wait_max, waited)
+
+  def recreate(self):
+    # pool.dispose() and friends make a new pool, keep the numbers going
+    new = super().recreate()
+    new.checkouts, new.wait_total = self.checkouts, self.wait_total
+    new.wait_max, new.timeouts = self.wait_max, self.timeouts
+    return new
+
+
+def engine_options(config):
+  url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+  options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+  if url.get_backend_name() == 'sqlite':
+    if url.database in (None, '', ':memory:'):
+      # one connection holds the whole db, flask-sqlalchemy pins it
+      return options
+    # a file is shared like a server would be; connections move between
+    # the threads checking them out
+    options['connect_args'] = {'check_same_thread': False}
+  options.update(
+    poolclass=TimedQueuePool,
+    pool_size=config['DB_POOL_SIZE'],
+    max_overflow=config['DB_MAX_OVERFLOW'],
+    pool_timeout=config['DB_POOL_TIMEOUT'],
+    pool_recycle=config['DB_POOL_RECYCLE'],
+  )
+  return options
+
+
+def statement_timeout(ms):
+  # per view override of DB_STATEMENT_TIMEOUT, e.g. for exports
+  def decorate(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      g.statement_timeout = ms
+      return view(*args, **kwargs)
+    return wrapper
+  return decorate
+
+
+def _set_statement_timeout(sess, transaction, connection):
+  if connection.dialect.name != 'postgresql':
+    return
+  ms = current_app.config['DB_STATEMENT_TIMEOUT']
+  if has_request_context():
+    ms = g.get('statement_timeout', ms)
+  # local to the transaction, so it goes away with the connection's
+  # checkin and never leaks into the next request
+  connection.execute(text('set local statement_timeout = :ms'), {'ms': int(ms)})
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+  # sqlite ignores foreign keys unless asked, and with them the ON DELETE
+  # CASCADE from Venue and Artist to Show that deletes rely on
+  if isinstance(dbapi_connection, sqlite3.Connection):
+    dbapi_connection.execute('pragma foreign_keys = on')
+
+
+def stats():
+  pool = db.engine.pool
+  numbers = {'class': type(pool).__name__}
+  if isinstance(pool, QueuePool):
+    numbers.update(
+      size=pool.size(),
+      checked_out=pool.checkedout(),
+      checked_in=pool.checkedin(),
+      overflow=max(pool.overflow(), 0),
+    )
+  if isinstance(pool, TimedQueuePool):
+    numbers.update(
+      checkouts=pool.checkouts,
+      wait_total_ms=round(pool.wait_total * 1000, 3),
+      wait_max_ms=round(pool.wait_max * 1000, 3),
+      timeouts=pool.timeouts,
+    )
+  return numbers
+
+
+health = Blueprint('health', __name__, url_prefix='/health')
+
+
+@health.route('')
+def ping():
+  db.session.execute(text('select 1'))
+  return jsonify({'ok': True})
+
+
+@health.route('/pool')
+def pool_stats():
+  return jsonify(stats())
+
+
+def init(app):
+  app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+  app.register_blueprint(health)
+
+
+event.listen(db.session, 'after_begin', _set_statement_timeout)
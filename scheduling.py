@@ -0,0 +1,120 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+from sqlalchemy import DDL, event
+from models import db, Show
+
+
+# double booking checks. a venue can't host two shows at once and an artist
+# can't play two. shows are [start_time, end_time) and no longer than
+# MAX_DURATION, which is what keeps a lookup to an index range: anything
+# overlapping a new show has to start within MAX_DURATION before its end, so
+# the (venue_id, start_time) and (artist_id, start_time) indexes find it no
+# matter how many shows the venue has had.
+#
+# on postgres the exclusion constraints below are the real guarantee, the
+# query is there for a readable message. elsewhere the query is all there is.
+
+DEFAULT_DURATION = timedelta(hours=2)
+MAX_DURATION = timedelta(hours=24)
+
+SIDES = (('venue_id', 'venue'), ('artist_id', 'artist'))
+
+
+def end_time(start, end=None):
+  return end or start + DEFAULT_DURATION
+
+
+def check_times(start, end):
+  # None if fine, otherwise what's wrong with them
+  if end <= start:
+    return 'a show has to end after it starts'
+  if end - start > MAX_DURATION:
+    return f'a show can be at most {MAX_DURATION.total_seconds() // 3600:.0f} hours long'
+  return None
+
+
+def conflicts(d):
+  # what the venue or artist of d (a show as a dict) already has on at the
+  # same time, as messages for the form
+  found = []
+  for attr, name in SIDES:
+    column = getattr(Show, attr)
+    clash = db.session.query(Show.id, Show.start_time, Show.end_time) \
+      .filter(column == d[attr]) \
+      .filter(Show.start_time > d['start_time'] - MAX_DURATION) \
+      .filter(Show.start_time < d['end_time']) \
+      .filter(Show.end_time > d['start_time']) \
+      .first()
+    if clash:
+      found.append(_booked(name, d[attr], f'show {clash.id}, '
+        f'{clash.start_time:%Y-%m-%d %H:%M} to {clash.end_time:%H:%M}'))
+  return found
+
+
+def _booked(name, id, what):
+  return f'{name} {id} is already booked then ({what})'
+
+
+class IntervalIndex:
+  # sorted [start, end) intervals per key. with every interval at most
+  # max_length long, an overlap query is a bisect plus a scan over the few
+  # intervals starting in [start - max_length, end)
+  def __init__(self, max_length):
+    self.max_length = max_length
+    self.intervals = {}
+
+  def add(self, key, start, end, value=None):
+    insort(self.intervals.setdefault(key, []), (start, end, value))
+
+  def overlapping(self, key, start, end):
+    intervals = self.intervals.get(key, [])
+    i = bisect_left(intervals, (start - self.max_length,))
+    found = []
+    while i < len(intervals) and intervals[i][0] < end:
+      if intervals[i][1] > start:
+        found.append(intervals[i])
+      i += 1
+    return found
+
+
+def check_chunk(records, report):
+  # for bulk imports. one query per side loads what the chunk's venues and
+  # artists already have around its time span, then every row is checked
+  # against that and against the rows before it in the chunk
+  if not records:
+    return records
+  lo = min(d['start_time'] for _, d in records) - MAX_DURATION
+  hi = max(d['end_time'] for _, d in records)
+  indexes = {}
+  for attr, _ in SIDES:
+    column = getattr(Show, attr)
+    index = indexes[attr] = IntervalIndex(MAX_DURATION)
+    for key, id, start, end in db.session.query(column, Show.id, Show.start_time, Show.end_time) \
+        .filter(column.in_({d[attr] for _, d in records})) \
+        .filter(Show.start_time > lo, Show.start_time < hi):
+      index.add(key, start, end, f'show {id}')
+  checked = []
+  for n, d in records:
+    clash = None
+    for attr, name in SIDES:
+      found = indexes[attr].overlapping(d[attr], d['start_time'], d['end_time'])
+      if found:
+        clash = _booked(name, d[attr], found[0][2])
+        break
+    if clash:
+      report.error(n, clash)
+      continue
+    for attr, _ in SIDES:
+      indexes[attr].add(d[attr], d['start_time'], d['end_time'], f'row {n}')
+    checked.append((n, d))
+  return checked
+
+
+event.listen(Show.__table__, 'after_create', DDL(
+  'create extension if not exists btree_gist'
+).execute_if(dialect='postgresql'))
+for attr, side in SIDES:
+  event.listen(Show.__table__, 'after_create', DDL(
+    f'alter table "Show" add constraint "ex_Show_{side}_overlap" exclude using gist '
+    f'({attr} with =, tsrange(start_time, end_time) with &&)'
+  ).execute_if(dialect='postgresql'))
@@ -0,0 +1,142 @@
+import re
+from flask import current_app
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import joinedload
+from models import db, transaction, Artist, Venue
+from jobs import task
+
+
+# every searchable row carries a lowercased `search_text` made of its name,
+# city, state and genre names. postgres indexes it with a pg_trgm gin index
+# (which serves LIKE '%x%' without a seq scan); sqlite, which has no trigram
+# ops, mirrors it into an fts5 table keyed by the row id.
+
+SEARCHABLE = (Venue, Artist)
+
+
+def query(model, term):
+  tokens = _tokens(term)
+  limit = current_app.config['SEARCH_LIMIT']
+  if not tokens:
+    return model.query.order_by(model.name, model.id).limit(limit)
+  dialect = db.engine.dialect.name
+  if dialect == 'postgresql':
+    q = _like(model, tokens)
+    rank = db.func.similarity(model.search_text, ' '.join(tokens))
+    return q.order_by(rank.desc(), model.name, model.id).limit(limit)
+  if dialect == 'sqlite':
+    fts = _fts_table(model)
+    match = ' '.join('"{}"*'.format(t.replace('"', '""')) for t in tokens)
+    return model.query \
+      .join(fts, fts.c.rowid == model.id) \
+      .filter(db.literal_column(f'"{fts.name}"').op('MATCH')(match)) \
+      .order_by(fts.c.rank) \
+      .limit(limit)
+  return _like(model, tokens).order_by(model.name, model.id).limit(limit)
+
+
+def prefix(model, term, limit):
+  # names starting with term, for autocomplete. both sides of it are an
+  # index range over lower(name): postgres turns LIKE 'x%' into one through
+  # text_pattern_ops, elsewhere the range is spelled out
+  term = term.lower()
+  name = db.func.lower(model.name)
+  q = db.session.query(model.id, model.name)
+  if not term:
+    return q.order_by(name, model.id).limit(limit)
+  if db.engine.dialect.name == 'postgresql':
+    q = q.filter(name.like(re.sub(r'([\\%_])', r'\\\1', term) + '%', escape='\\'))
+  else:
+    q = q.filter(name >= term, name < term[:-1] + chr(ord(term[-1]) + 1))
+  return q.order_by(name, model.id).limit(limit)
+
+
+def document(entity):
+  parts = [entity.name, entity.city, entity.state]
+  parts += [g.name for g in entity.genres]
+  return ' '.join(p for p in parts if p).lower()
+
+
+@task('search.reindex')
+def reindex(chunk=500):
+  # rebuilds the documents that have gone out of date, e.g. after a change
+  # to document() or a genre renamed in the db. only rows that come out
+  # different get written
+  for model in SEARCHABLE:
+    last = 0
+    while True:
+      with transaction():
+        rows = model.query \
+          .options(joinedload(model.genres)) \
+          .filter(model.id > last) \
+          .order_by(model.id) \
+          .limit(chunk) \
+          .all()
+        for row in rows:
+          text = document(row)
+          if row.search_text != text:
+            row.search_text = text
+        last = rows[-1].id if rows else last
+      if len(rows) < chunk:
+        break
+
+
+def _tokens(term):
+  return re.findall(r'\w+', term.lower())
+
+
+def _like(model, tokens):
+  q = model.query
+  for t in tokens:
+    pattern = re.sub(r'([\\%_])', r'\\\1', t)
+    q = q.filter(model.search_text.like(f'%{pattern}%', escape='\\'))
+  return q
+
+
+def _fts_table(model):
+  return db.table(f'{model.__tablename__}Search', db.column('rowid'), db.column('rank'))
+
+
+def _set_document(mapper, connection, target):
+  target.search_text = document(target)
+
+
+def _mirror(mapper, connection, target):
+  if connection.dialect.name != 'sqlite':
+    return
+  fts = _fts_table(mapper.class_)
+  connection.execute(fts.delete().where(fts.c.rowid == target.id))
+  connection.execute(
+    db.text(f'insert into "{fts.name}" (rowid, search_text) values (:id, :text)'),
+    {'id': target.id, 'text': target.search_text}
+  )
+
+
+def _unmirror(mapper, connection, target):
+  if connection.dialect.name != 'sqlite':
+    return
+  fts = _fts_table(mapper.class_)
+  connection.execute(fts.delete().where(fts.c.rowid == target.id))
+
+
+for cls in SEARCHABLE:
+  event.listen(cls, 'before_insert', _set_document)
+  event.listen(cls, 'before_update', _set_document)
+  event.listen(cls, 'after_insert', _mirror)
+  event.listen(cls, 'after_update', _mirror)
+  event.listen(cls, 'after_delete', _unmirror)
+  # so that db.create_all() on a scratch db gets the trigram index or the fts
+  # table too, the same as the migration makes them. neither is in the
+  # metadata, migrations/env.py keeps autogenerate off them
+  name = cls.__tablename__
+  event.listen(cls.__table__, 'before_create', DDL(
+    'create extension if not exists pg_trgm'
+  ).execute_if(dialect='postgresql'))
+  event.listen(cls.__table__, 'after_create', DDL(
+    f'create index if not exists "ix_{name}_search_text_trgm" on "{name}" '
+    'using gin (search_text gin_trgm_ops)'
+  ).execute_if(dialect='postgresql'))
+  event.listen(cls.__table__, 'after_create', DDL(
+    f'create virtual table if not exists "{name}Search" '
+    'using fts5(search_text)'
+  ).execute_if(dialect='sqlite'))
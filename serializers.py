@@ -0,0 +1,77 @@
+# the dicts handed to the templates, shared with the json api
+
+
+def venue_detail(venue, past, upcoming):
+  return {
+    'id': venue.id,
+    'name': venue.name,
+    'genres': [g.name for g in venue.genres],
+    'address': venue.address,
+    'city': venue.city,
+    'state': venue.state,
+    'phone': venue.phone,
+    'website': venue.website,
+    'facebook_link': venue.facebook_link,
+    'seeking_talent': venue.seeking_talent,
+    'seeking_description': venue.seeking_description,
+    'image_link': venue.image_link,
+    'past_shows': [venue_show(s) for s in past],
+    'upcoming_shows': [venue_show(s) for s in upcoming],
+    'past_shows_count': len(past),
+    'upcoming_shows_count': len(upcoming),
+  }
+
+
+def artist_detail(artist, past, upcoming):
+  return {
+    'id': artist.id,
+    'name': artist.name,
+    'genres': [g.name for g in artist.genres],
+    'city': artist.city,
+    'state': artist.state,
+    'phone': artist.phone,
+    'website': artist.website,
+    'facebook_link': artist.facebook_link,
+    'seeking_venue': artist.seeking_venue,
+    'seeking_description': artist.seeking_description,
+    'image_link': artist.image_link,
+    'past_shows': [artist_show(s) for s in past],
+    'upcoming_shows': [artist_show(s) for s in upcoming],
+    'past_shows_count': len(past),
+    'upcoming_shows_count': len(upcoming),
+  }
+
+
+def venue_show(s):
+  # a show as listed on its venue's page
+  return {
+    'artist_id': s.artist_id,
+    'artist_name': s.artist.name,
+    'artist_image_link': s.artist.image_link,
+    'start_time': s.start_time,
+    'end_time': s.end_time,
+  }
+
+
+def artist_show(s):
+  # a show as listed on its artist's page
+  return {
+    'venue_id': s.venue_id,
+    'venue_name': s.venue.name,
+    'venue_image_link': s.venue.image_link,
+    'start_time': s.start_time,
+    'end_time': s.end_time,
+  }
+
+
+def show(s):
+  return {
+    'id': s.id,
+    'venue_id': s.venue_id,
+    'venue_name': s.venue.name,
+    'artist_id': s.artist_id,
+    'artist_name': s.artist.name,
+    'artist_image_link': s.artist.image_link,
+    'start_time': s.start_time,
+    'end_time': s.end_time,
+  }
@@ -0,0 +1,33 @@
+// autocomplete for id fields: <input data-lookup="artists" list="...">. the
+// datalist gets the names matching what's been typed so far, with the id as
+// the value that ends up in the field
+(function () {
+  function attach(input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var kind = input.getAttribute('data-lookup');
+    var timer = null;
+    var last = null;
+    input.addEventListener('input', function () {
+      var q = input.value.trim();
+      // an id picked from the list, nothing more to look up
+      if (/^\d+$/.test(q) || q === last) return;
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        last = q;
+        fetch('/api/v1/lookup/' + kind + '?q=' + encodeURIComponent(q))
+          .then(function (response) { return response.json(); })
+          .then(function (body) {
+            list.innerHTML = '';
+            body.data.forEach(function (item) {
+              var option = document.createElement('option');
+              option.value = item.id;
+              option.label = item.name;
+              option.textContent = item.name;
+              list.appendChild(option);
+            });
+          });
+      }, 150);
+    });
+  }
+  document.querySelectorAll('input[data-lookup]').forEach(attach);
+})();
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+import pytest
+import config
+from models import db, transaction, Artist, Show, Venue
+
+
+# every test gets an app of its own on TestingConfig, i.e. a fresh in-memory
+# sqlite db unless TEST_DATABASE_URL says otherwise
+
+
+@pytest.fixture
+def app():
+  from app import create_app
+  app = create_app(config.TestingConfig)
+  with app.app_context():
+    db.create_all()
+    yield app
+    db.session.remove()
+    db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+  return app.test_client()
+
+
+@pytest.fixture
+def at():
+  # whole hours from a fixed point well in the future, so nothing rolls over
+  # while a test runs
+  base = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=30)
+  return lambda hours: base + timedelta(hours=hours)
+
+
+@pytest.fixture
+def make(app):
+  # make.venue(...), make.artist(...), make.show(venue, artist, start, end),
+  # each committed through transaction() like the views do, handing back ids
+  class Make:
+    def _add(self, obj):
+      with transaction() as sess:
+        sess.add(obj)
+        sess.flush()
+        return obj.id
+
+    def venue(self, name='The Venue', city='San Francisco', state='CA', **kwargs):
+      return self._add(Venue(name=name, city=city, state=state, **kwargs))
+
+    def artist(self, name='The Artist', city='San Francisco', state='CA', **kwargs):
+      return self._add(Artist(name=name, city=city, state=state, **kwargs))
+
+    def show(self, venue_id, artist_id, start, end=None):
+      return self._add(Show(
+        venue_id=venue_id, artist_id=artist_id,
+        start_time=start, end_time=end or start + timedelta(hours=2),
+      ))
+
+  return Make()
@@ -0,0 +1,56 @@
+import json
+import os
+import assets
+
+
+STATIC = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
+
+
+def _write(path, data='x'):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'w') as f:
+    f.write(data)
+
+
+def test_build_keeps_what_was_there(tmp_path):
+  out = tmp_path / 'dist'
+  _write(out / 'css' / 'app.0123456789ab.css')
+  manifest = assets.Build(STATIC, str(out)).run()
+  # a worker on the old build can still get its stylesheet
+  assert (out / 'css' / 'app.0123456789ab.css').exists()
+  assert (out / f'manifest.{manifest["hash"]}.json').exists()
+  with open(out / 'manifest.json') as f:
+    loaded = json.load(f)
+  assert (loaded['hash'], loaded['files']) == (manifest['hash'], manifest['files'])
+  assert assets.manifest_hash(loaded) == manifest['hash']
+  # the same sources, the same build
+  assert assets.Build(STATIC, str(out)).run()['hash'] == manifest['hash']
+
+
+def test_prune(tmp_path):
+  out = tmp_path / 'dist'
+  builds = [
+    {'files': {'css/app.css': f'css/app.{n}.css', 'js/app.js': 'js/app.1.js'}, 'srcset': {}}
+    for n in range(3)
+  ]
+  for n, manifest in enumerate(builds):
+    manifest['hash'] = assets.manifest_hash(manifest)
+    for name in (f'manifest.{manifest["hash"]}.json', 'manifest.json'):
+      _write(out / name, json.dumps(manifest))
+      os.utime(out / name, (n, n))
+    for hashed in manifest['files'].values():
+      _write(out / hashed)
+      _write(out / (hashed + '.gz'))
+  _write(out / 'img' / 'gone.jpg')
+
+  removed = assets.prune(str(out), keep=2)
+  assert removed == [
+    'css/app.0.css', 'css/app.0.css.gz', 'img/gone.jpg', f'manifest.{builds[0]["hash"]}.json',
+  ]
+  assert not (out / 'img').exists()
+  for name in ('css/app.1.css', 'css/app.2.css.gz', 'js/app.1.js', 'manifest.json'):
+    assert (out / name).exists()
+
+  assert assets.prune(str(out), keep=1) == [
+    'css/app.1.css', 'css/app.1.css.gz', f'manifest.{builds[1]["hash"]}.json',
+  ]
@@ -0,0 +1,52 @@
+from datetime import timedelta
+import pytest
+import config
+from models import db, Venue
+
+
+@pytest.fixture
+def app():
+  from app import create_app
+  app = create_app(config.TestingConfig, CACHE_BACKEND='memory')
+  with app.app_context():
+    db.create_all()
+    yield app
+    db.session.remove()
+    db.drop_all()
+
+
+def test_cached_page_goes_with_its_etag(client, make):
+  id = make.venue(name='Before')
+  first = client.get(f'/venues/{id}')
+  assert first.headers['X-Cache'] == 'MISS'
+  assert client.get(f'/venues/{id}').headers['X-Cache'] == 'HIT'
+
+  # a write the page cache hasn't heard of yet: its invalidation is still on
+  # the way, or it came from a worker without the cache
+  updated_at = db.session.get(Venue, id).updated_at
+  db.session.execute(Venue.__table__.update().where(Venue.id == id).values(
+    name='After', updated_at=updated_at + timedelta(seconds=1),
+  ))
+  db.session.commit()
+
+  second = client.get(f'/venues/{id}')
+  assert second.headers['ETag'] != first.headers['ETag']
+  # not the body from before under the new etag
+  assert second.headers['X-Cache'] == 'MISS'
+  assert b'After' in second.data
+  revalidated = client.get(f'/venues/{id}', headers={'If-None-Match': second.headers['ETag']})
+  assert revalidated.status_code == 304
+  # and a client holding the old one gets the new page
+  assert client.get(f'/venues/{id}', headers={'If-None-Match': first.headers['ETag']}).data == second.data
+
+
+def test_workers_agree_on_the_etag(app, make):
+  from app import create_app
+  # another process serving the same code, started later
+  other = create_app(config.TestingConfig, CACHE_BACKEND='memory')
+  id = make.venue()
+  etag = app.test_client().get(f'/venues/{id}').headers['ETag']
+  with other.app_context():
+    response = other.test_client().get(f'/venues/{id}', headers={'If-None-Match': etag})
+  assert response.status_code == 304
+  assert app.extensions['release'] == other.extensions['release']
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+import areas
+import bulk
+import counters
+from models import db, area_summary, area_venues, transaction, Artist, Show, Venue
+
+
+# the show counters on Venue/Artist and the area summary copied off them,
+# checked against what a full recount makes of the same shows
+
+
+def _counts(model, id):
+  row = db.session.execute(
+    db.select(model.upcoming_show_count, model.past_show_count, model.next_show_at)
+      .where(model.id == id)
+  ).one()
+  return tuple(row)
+
+
+def _areas():
+  return {
+    'areas': sorted(tuple(r) for r in db.session.execute(db.select(area_summary))),
+    'venues': sorted(tuple(r) for r in db.session.execute(db.select(area_venues))),
+  }
+
+
+def _matches_a_rebuild():
+  # the same counts rebuilt from scratch, then thrown away
+  before = _areas(), [_counts(m, id) for m, _ in counters.SIDES for id, in db.session.query(m.id)]
+  counters.rebuild(db.session)
+  areas.rebuild(db.session)
+  after = _areas(), [_counts(m, id) for m, _ in counters.SIDES for id, in db.session.query(m.id)]
+  db.session.rollback()
+  return before == after
+
+
+def test_new_show(make, at):
+  v, a = make.venue(), make.artist()
+  make.venue(name='Empty')
+  make.show(v, a, at(0))
+  assert _counts(Venue, v) == _counts(Artist, a) == (1, 0, at(0))
+  assert _areas()['areas'] == [('CA', 'San Francisco', 2, 1)]
+  assert ('CA', 'San Francisco', 'The Venue', 1) in [r[1:] for r in _areas()['venues']]
+  assert _matches_a_rebuild()
+
+
+def test_deleting_a_venue_recounts_its_artists(client, make, at):
+  v, other, a = make.venue(), make.venue(name='Other', city='Oakland'), make.artist()
+  make.show(v, a, at(0))
+  make.show(v, a, at(4))
+  make.show(other, a, at(8))
+  assert _counts(Artist, a) == (3, 0, at(0))
+
+  assert client.delete(f'/venues/{v}').json == {'ok': True}
+  # the shows went with it, ON DELETE CASCADE, and the artist knows
+  assert db.session.query(Show).filter_by(venue_id=v).count() == 0
+  assert _counts(Artist, a) == (1, 0, at(8))
+  assert _areas() == {
+    'areas': [('CA', 'Oakland', 1, 1)],
+    'venues': [(other, 'CA', 'Oakland', 'Other', 1)],
+  }
+  assert _matches_a_rebuild()
+
+
+def test_bulk_import(make, at):
+  v, w, a, b = make.venue(), make.venue(name='W'), make.artist(), make.artist(name='B')
+  fmt = '%Y-%m-%d %H:%M:%S'
+  past = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=2)
+  rows = [
+    (1, {'venue_id': v, 'artist_id': a, 'start_time': at(0).strftime(fmt)}),
+    (2, {'venue_id': v, 'artist_id': b, 'start_time': at(2).strftime(fmt)}),
+    (3, {'venue_id': w, 'artist_id': b, 'start_time': past.strftime(fmt)}),
+  ]
+  report = bulk.import_rows('shows', rows, chunk_size=2)
+  assert (report.imported, report.errors) == (3, [])
+  # core inserts, seen through note_changes
+  assert _counts(Venue, v) == (2, 0, at(0))
+  assert _counts(Venue, w) == (0, 1, None)
+  assert _counts(Artist, b) == (1, 1, at(2))
+  assert _areas()['areas'] == [('CA', 'San Francisco', 2, 2)]
+  assert _matches_a_rebuild()
+
+
+def test_rollover(make, at):
+  v, a = make.venue(), make.artist()
+  make.show(v, a, at(0))
+  make.show(v, a, at(4))
+  # time passes: the first show starts, with nothing written
+  started = datetime.now().replace(microsecond=0) - timedelta(minutes=5)
+  db.session.execute(Show.__table__.update().where(Show.start_time == at(0))
+    .values(start_time=started, end_time=started + timedelta(hours=2)))
+  for model in (Venue, Artist):
+    db.session.execute(model.__table__.update().values(next_show_at=started))
+  db.session.commit()
+  assert _counts(Venue, v) == (2, 0, started)
+
+  with transaction() as sess:
+    assert counters.rollover(sess) == 2
+  assert _counts(Venue, v) == _counts(Artist, a) == (1, 1, at(4))
+  assert _areas()['areas'] == [('CA', 'San Francisco', 1, 1)]
+  # nothing more to do until the next one starts
+  with transaction() as sess:
+    assert counters.rollover(sess) == 0
+  assert _matches_a_rebuild()
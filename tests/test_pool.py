@@ -0,0 +1,117 @@
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError
+import pool
+from pool import TimedQueuePool
+
+
+# a file-backed sqlite db standing in for postgres: one connection to go
+# round, a pile of threads wanting it
+
+
+def _engine(path, timeout):
+  return create_engine(
+    f'sqlite:///{path}', poolclass=TimedQueuePool, pool_size=1, max_overflow=0,
+    pool_timeout=timeout, connect_args={'check_same_thread': False},
+  )
+
+
+def _hammer(threads, work):
+  errors = []
+  def run():
+    try:
+      work()
+    except Exception as e:
+      errors.append(e)
+  started = [threading.Thread(target=run) for _ in range(threads)]
+  for t in started:
+    t.start()
+  for t in started:
+    t.join()
+  return errors
+
+
+def test_checkouts_queue_up_for_the_one_connection(tmp_path):
+  engine = _engine(tmp_path / 'pool.db', timeout=5)
+
+  def work():
+    for _ in range(5):
+      with engine.connect() as conn:
+        conn.execute(text('select 1'))
+        time.sleep(0.005)
+
+  assert _hammer(8, work) == []
+  p = engine.pool
+  assert p.checkouts == 40
+  assert p.timeouts == 0
+  # everyone but the first in line waited for someone else's 5ms at least
+  assert p.wait_max >= 0.005
+  assert p.wait_total >= p.wait_max
+  assert p.checkedout() == 0
+
+
+def test_timeouts_are_counted(tmp_path):
+  engine = _engine(tmp_path / 'pool.db', timeout=0.1)
+  with engine.connect():
+    # the only connection is taken, every other checkout gives up
+    errors = _hammer(4, lambda: engine.connect().close())
+  assert len(errors) == 4
+  assert all(isinstance(e, TimeoutError) for e in errors)
+  p = engine.pool
+  assert p.checkouts == 5
+  assert p.timeouts == 4
+  assert p.wait_max >= 0.1
+
+
+def test_numbers_survive_dispose(tmp_path):
+  engine = _engine(tmp_path / 'pool.db', timeout=5)
+  for _ in range(3):
+    engine.connect().close()
+  engine.dispose()
+  assert engine.pool.checkouts == 3
+
+
+def test_engine_options():
+  config = {
+    'DB_POOL_PRE_PING': True, 'DB_POOL_SIZE': 1, 'DB_MAX_OVERFLOW': 0,
+    'DB_POOL_TIMEOUT': 1, 'DB_POOL_RECYCLE': 60,
+  }
+  memory = pool.engine_options({**config, 'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+  assert 'poolclass' not in memory
+  file = pool.engine_options({**config, 'SQLALCHEMY_DATABASE_URI': 'sqlite:////tmp/x.db'})
+  assert file['poolclass'] is TimedQueuePool
+  assert file['connect_args'] == {'check_same_thread': False}
+  pg = pool.engine_options({**config, 'SQLALCHEMY_DATABASE_URI': 'postgresql://u@h/db'})
+  assert pg['poolclass'] is TimedQueuePool
+  assert (pg['pool_size'], pg['max_overflow'], pg['pool_timeout']) == (1, 0, 1)
+  assert 'connect_args' not in pg
+
+
+@pytest.fixture
+def app(tmp_path):
+  from app import create_app
+  import config
+  return create_app(
+    config.TestingConfig,
+    SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "app.db"}',
+    DB_POOL_SIZE=1, DB_MAX_OVERFLOW=0, DB_POOL_TIMEOUT=5,
+  )
+
+
+def test_health_pool_under_load(app):
+  def work():
+    client = app.test_client()
+    for _ in range(5):
+      assert client.get('/health').json == {'ok': True}
+
+  assert _hammer(6, work) == []
+  stats = app.test_client().get('/health/pool').json
+  assert stats['class'] == 'TimedQueuePool'
+  assert stats['size'] == 1
+  assert stats['checked_out'] == 0
+  assert stats['overflow'] == 0
+  assert stats['checkouts'] >= 30
+  assert stats['timeouts'] == 0
+  assert stats['wait_max_ms'] >= 0
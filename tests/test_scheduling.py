@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+import pytest
+from bulk import Report
+from scheduling import MAX_DURATION, IntervalIndex, check_chunk, check_times, conflicts
+
+
+T = datetime(2030, 1, 1, 20)
+H = timedelta(hours=1)
+
+
+def test_index_back_to_back_is_not_an_overlap():
+  index = IntervalIndex(MAX_DURATION)
+  index.add(1, T, T + 2 * H, 'a')
+  assert index.overlapping(1, T + 2 * H, T + 4 * H) == []
+  assert index.overlapping(1, T - 2 * H, T) == []
+
+
+def test_index_overlaps():
+  index = IntervalIndex(MAX_DURATION)
+  index.add(1, T, T + 2 * H, 'a')
+  index.add(1, T + 3 * H, T + 4 * H, 'b')
+  assert [v for _, _, v in index.overlapping(1, T + H, T + 3 * H + H // 2)] == ['a', 'b']
+  # inside, around
+  assert [v for _, _, v in index.overlapping(1, T + H // 2, T + H)] == ['a']
+  assert [v for _, _, v in index.overlapping(1, T - H, T + 5 * H)] == ['a', 'b']
+  # other keys are someone else
+  assert index.overlapping(2, T, T + 2 * H) == []
+
+
+def test_index_looks_back_max_length():
+  index = IntervalIndex(MAX_DURATION)
+  # as long as a show gets: one starting exactly MAX_DURATION before ends
+  # right as the new one starts, a minute later it runs into it
+  index.add(1, T - MAX_DURATION, T, 'edge')
+  index.add(1, T - MAX_DURATION + timedelta(minutes=1), T + timedelta(minutes=1), 'in')
+  assert [v for _, _, v in index.overlapping(1, T, T + H)] == ['in']
+
+
+@pytest.mark.parametrize('start, end, ok', [
+  (T, T + 2 * H, True),
+  (T, T + MAX_DURATION, True),
+  (T, T, False),
+  (T, T - H, False),
+  (T, T + MAX_DURATION + timedelta(minutes=1), False),
+])
+def test_check_times(start, end, ok):
+  assert (check_times(start, end) is None) is ok
+
+
+def _show(venue_id, artist_id, start, end):
+  return {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start, 'end_time': end}
+
+
+def test_conflicts(make, at):
+  v, other_v = make.venue(), make.venue(name='Other')
+  a, other_a = make.artist(), make.artist(name='Other')
+  make.show(v, a, at(0), at(2))
+
+  # back to back, either side
+  assert conflicts(_show(v, a, at(2), at(4))) == []
+  assert conflicts(_show(v, a, at(-2), at(0))) == []
+  # the venue's busy
+  found = conflicts(_show(v, other_a, at(1), at(3)))
+  assert len(found) == 1 and found[0].startswith(f'venue {v} is already booked')
+  # the artist's busy
+  found = conflicts(_show(other_v, a, at(-1), at(1)))
+  assert len(found) == 1 and found[0].startswith(f'artist {a} is already booked')
+  # both
+  assert len(conflicts(_show(v, a, at(0), at(2)))) == 2
+  assert conflicts(_show(other_v, other_a, at(0), at(2))) == []
+
+
+def test_conflicts_look_back_max_length(make, at):
+  v, a = make.venue(), make.artist()
+  make.show(v, a, at(-24), at(0))
+  assert conflicts(_show(v, a, at(0), at(2))) == []
+  later = make.venue(name='Later')
+  make.show(later, make.artist(name='Later'), at(-24) + timedelta(minutes=1), at(0) + timedelta(minutes=1))
+  assert len(conflicts(_show(later, a, at(0), at(2)))) == 1
+
+
+def test_check_chunk(make, at):
+  v, a, b = make.venue(), make.artist(), make.artist(name='B')
+  make.show(v, a, at(0), at(2))
+  records = [
+    # clashes with the show in the db
+    (1, _show(v, b, at(1), at(3))),
+    # back to back with it
+    (2, _show(v, b, at(2), at(4))),
+    # clashes with row 2, which made it in
+    (3, _show(v, a, at(3), at(5))),
+    # back to back with row 2
+    (4, _show(v, a, at(4), at(6))),
+    # a day long, ending right as row 2 starts: fine. one starting a minute
+    # later would overlap the show in the db, MAX_DURATION back
+    (5, _show(make.venue(name='C'), b, at(2) - MAX_DURATION, at(2))),
+    (6, _show(make.venue(name='D'), a, at(2) - MAX_DURATION + timedelta(minutes=1),
+              at(2) + timedelta(minutes=1))),
+  ]
+  report = Report()
+  checked = check_chunk(records, report)
+  assert [n for n, _ in checked] == [2, 4, 5]
+  errors = dict(report.errors)
+  assert sorted(errors) == [1, 3, 6]
+  assert errors[1] == f'venue {v} is already booked then (show 1)'
+  assert errors[3] == f'venue {v} is already booked then (row 2)'
+  assert errors[6] == f'artist {a} is already booked then (show 1)'
+
+
+def test_check_chunk_empty():
+  assert check_chunk([], Report()) == []